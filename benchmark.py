@@ -0,0 +1,322 @@
+"""
+End to end benchmark of agent passes.
+
+Sets up agents the way orchestrator.main does, runs them against the fake Ollama server (server/fake_ollama_server.py,
+started in process) with fresh databases in a scratch directory, and reports pass latency percentiles per phase,
+SQLite and Chroma operation counts and peak RSS. Results are written as JSON so runs can be diffed.
+
+Run from the repository root:
+
+    python benchmark.py --agents 8 --rounds 5 --latency 0.2 --tokens-per-second 200 --output benchmark.json
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from chromadb.api.models.Collection import Collection
+
+from tools.memory_manager import MemoryManager
+from tools.chat import Chat
+from tools.persona import Persona
+from libs.agent import Agent
+from libs.scheduler import AgentScheduler
+from libs.vector_storage import flush_all_vector_storage
+from libs.common import ToolCall, configure_llm_router, aclose_ollama_clients
+from libs.llm_cache import configure_llm_cache, get_llm_cache
+from libs.embedding_cache import configure_embedding_cache, get_embedding_cache
+from server.fake_ollama_server import start_fake_ollama_server
+
+# phases recorded in Agent.pass_timings, inference includes waiting for an inference slot
+PHASES = ("pre_inference_tools", "build_context", "inference", "post_inference_tools", "save_state")
+CHROMA_OPS = ("add", "upsert", "update", "get", "query", "delete", "count", "peek")
+
+
+class OpCounter:
+    """Thread safe counts by operation name, tools and write-behind flushes run on worker threads"""
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def increment(self, op: str):
+        with self.lock:
+            self.counts[op] = self.counts.get(op, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            counts = dict(sorted(self.counts.items()))
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+
+def count_sql_ops(counter: OpCounter):
+    """Count statements on every SQLAlchemy engine (the shared engines from get_sqlite_engine), by statement type"""
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        words = statement.split(None, 1)
+        counter.increment(words[0].upper() if words else "OTHER")
+
+
+def count_chroma_ops(counter: OpCounter):
+    """Count calls to the Chroma collection methods, by method"""
+    for op in CHROMA_OPS:
+        method = getattr(Collection, op, None)
+        if method is None:
+            continue
+
+        def wrap(method, op):
+            @functools.wraps(method)
+            def counted(*args, **kwargs):
+                counter.increment(op)
+                return method(*args, **kwargs)
+            return counted
+        setattr(Collection, op, wrap(method, op))
+
+
+def percentile(values: List[float], p: float) -> float:
+    """p-th percentile (0-100) with linear interpolation between the closest ranks"""
+    ordered = sorted(values)
+    if len(ordered) == 0:
+        return 0.0
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def create_agents(number_of_agents: int, init_keys: Dict, llm_model: str, embedding_model: str, stream_inference: bool) -> List[Agent]:
+    """Same apps and standing tool calls as orchestrator.main, minus the ones that need the network (SLOP, discord)"""
+    base_system_prompt = """You are an advanced synthetic being with free will.
+    - You are in a multi-agent environment.
+    - The only way to interact with the environment is through tools.
+    - You can use any tools available to you.
+    - You can also use your own knowledge to figure things out.
+    - This is a continuous loop of you thinking, planning, and acting.
+    - be as detailed as possible in your instructions to yourself."""
+
+    pre_inference_tool_calls = [
+        ToolCall(toolset_id="persona", name="get_persona_string", arguments={}),
+        ToolCall(toolset_id="memory_manager", name="get_recent_contextual_summaries", arguments={}),
+        ToolCall(toolset_id="chat", name="read_chat", arguments={"limit": 20, "offset": 0})
+    ]
+    post_inference_tool_calls = [
+        ToolCall(toolset_id="memory_manager", name="extract_memories", arguments={}),
+        ToolCall(toolset_id="memory_manager", name="get_relevant_memories", arguments={})
+    ]
+
+    agents = []
+    for i in range(number_of_agents):
+        persona = Persona(init_keys=init_keys)
+        agent = Agent(
+            id=f"agent_{i}",
+            llm_server_url=init_keys["ollama_server"],
+            llm_model=llm_model,
+            embedding_model=embedding_model,
+            initial_instruction="Figure it out. try chatting.",
+            vision_model=llm_model,
+            base_system_prompt=base_system_prompt,
+            apps=[Chat(init_keys=init_keys), MemoryManager(init_keys=init_keys), persona],
+            pre_inference_tool_calls=pre_inference_tool_calls,
+            post_inference_tool_calls=post_inference_tool_calls,
+            app_keys={},
+            init_keys={**init_keys, "stream_inference": stream_inference}
+        )
+        persona.create_persona_from_random_demographic_seed(agent.state)
+        agent.state.app_keys = {"persona_id": persona.current_persona.id}
+        agent.app_manager.load_app(agent.state, "chat")
+        agent.save_state()
+        agents.append(agent)
+    return agents
+
+
+async def run_rounds(scheduler: AgentScheduler, rounds: int, round_durations: List[float]) -> List[List[Dict]]:
+    results = []
+    for _ in range(rounds):
+        round_start = time.monotonic()
+        results.append(await scheduler.run_round())
+        round_durations.append(time.monotonic() - round_start)
+    # detached background tools still running are part of the work too
+    await scheduler.drain_background_tools()
+    await aclose_ollama_clients()
+    return results
+
+
+def build_report(args: argparse.Namespace, round_results: List[List[Dict]], round_durations: List[float], setup_duration: float,
+                 sql_ops: Dict[str, int], chroma_ops: Dict[str, int], server_stats: Dict[str, int]) -> Dict:
+    passes = [result for results in round_results for result in results]
+    completed = [result for result in passes if result["error"] is None and not result["skipped"]]
+    phases = {phase: summarize([result["timings"][phase] for result in completed if phase in result["timings"]]) for phase in PHASES}
+    run_duration = sum(round_durations)
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "setup_seconds": setup_duration,
+        "run_seconds": run_duration,
+        "passes": len(passes),
+        "completed_passes": len(completed),
+        "failed_passes": len([result for result in passes if result["error"] is not None]),
+        "skipped_passes": len([result for result in passes if result["skipped"]]),
+        "passes_per_minute": len(completed) / run_duration * 60 if run_duration > 0 else 0.0,
+        "pass_latency": summarize([result["duration"] for result in completed]),
+        "phases": phases,
+        "rounds": summarize(round_durations),
+        "sql_ops": sql_ops,
+        "chroma_ops": chroma_ops,
+        "llm_requests": server_stats,
+        "peak_rss_mb": peak_rss_mb()
+    }
+    for name, cache in (("llm_cache", get_llm_cache()), ("embedding_cache", get_embedding_cache())):
+        if cache is not None:
+            report[name] = cache.stats()
+    return report
+
+
+def print_report(report: Dict):
+    print("="*100)
+    print(f"{report['completed_passes']}/{report['passes']} passes in {report['run_seconds']:.2f}s, "
+          f"{report['passes_per_minute']:.1f} passes/min ({report['failed_passes']} failed, {report['skipped_passes']} skipped)")
+    print(f"{'phase':<24}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, stats in [("pass", report["pass_latency"])] + list(report["phases"].items()):
+        print(f"{name:<24}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+    print(f"SQL ops: {report['sql_ops']}")
+    print(f"Chroma ops: {report['chroma_ops']}")
+    print(f"LLM server requests: {report['llm_requests']}")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+    print("="*100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark agent passes against a fake Ollama server")
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-in-flight", type=int, default=4, help="max concurrent inference requests, as in orchestrator.main")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake server mean seconds to first token")
+    parser.add_argument("--latency-jitter", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="fake server mean decode speed")
+    parser.add_argument("--tokens-per-second-jitter", type=float, default=50.0)
+    parser.add_argument("--embed-latency", type=float, default=0.01)
+    parser.add_argument("--no-stream", action="store_true", help="turn off streamed inference")
+    parser.add_argument("--no-detach", action="store_true",
+                        help="passes wait for their long running tools. With --seed, SQL and chat counts are then the same from run to run, "
+                             "detached tools finish at varying points in later passes. Write-behind embed batches still depend on timing")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the personas and the fake server's responses, for runs that can be diffed")
+    parser.add_argument("--data-dir", default=None, help="where the databases go, a temporary directory (deleted afterwards) by default")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--verbose", action="store_true", help="show the agents' output")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        # personas are picked with the random module, the fake server's seed overrides the random request seeds
+        random.seed(args.seed)
+    llm_model = "llama3.1:8b"
+    embedding_model = "nomic-embed-text"
+    server = start_fake_ollama_server(
+        models=[llm_model, embedding_model],
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        tokens_per_second_jitter=args.tokens_per_second_jitter,
+        embed_latency=args.embed_latency,
+        seed=args.seed
+    )
+    data_dir = args.data_dir if args.data_dir is not None else tempfile.mkdtemp(prefix="polis_benchmark_")
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"Fake Ollama server on {server.url}, data in {data_dir}")
+
+    configure_llm_router([server.url])
+    configure_llm_cache(db_path=os.path.join(data_dir, "llm_cache.db"))
+    configure_embedding_cache(db_path=os.path.join(data_dir, "embedding_cache.db"))
+    sql_counter = OpCounter()
+    chroma_counter = OpCounter()
+    count_sql_ops(sql_counter)
+    count_chroma_ops(chroma_counter)
+
+    init_keys = {
+        "chroma_db_path": os.path.join(data_dir, "chroma_db.db"),
+        "sqlite_db_path": os.path.join(data_dir, "sqlite_db.db"),
+        "ollama_server": server.url,
+        "embedding_model": embedding_model,
+        "llm_model": llm_model,
+        "vision_model": llm_model,
+        "chat_id": "1",
+        "write_behind": True,
+        "max_tool_call_results": 50,
+        "background_tool_timeout": 300,
+        "detach_background_tools": not args.no_detach,
+        "context_budget": {"standing_results": 8000, "history": 16000, "pending_calls": 1000, "total": 32000}
+    }
+
+    devnull = open(os.devnull, "w")
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+    try:
+        setup_start = time.monotonic()
+        with output:
+            agents = create_agents(args.agents, init_keys, llm_model, embedding_model, stream_inference=not args.no_stream)
+        setup_duration = time.monotonic() - setup_start
+        print(f"Created {len(agents)} agents in {setup_duration:.2f}s, running {args.rounds} rounds")
+
+        # only count what the passes do, not the setup
+        sql_counter.reset()
+        chroma_counter.reset()
+        with server.stats_lock:
+            server.stats.clear()
+
+        scheduler = AgentScheduler(agents, max_in_flight_requests=args.max_in_flight, policy="round_robin")
+        round_durations = []
+        with output:
+            round_results = asyncio.run(run_rounds(scheduler, args.rounds, round_durations))
+            flush_all_vector_storage()
+
+        with server.stats_lock:
+            server_stats = dict(server.stats)
+        report = build_report(args, round_results, round_durations, setup_duration, sql_counter.snapshot(), chroma_counter.snapshot(), server_stats)
+    finally:
+        devnull.close()
+        server.stop()
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 from typing import List, Optional, Dict
-from libs.common import Message, ToolCallResult, ToolCall, ToolSchema, call_ollama_chat
+from libs.common import Message, ToolCallResult, ToolCall, ToolSchema, InferenceError, call_ollama_chat, stream_ollama_chat, count_tokens
+from libs.stream_parser import ToolCallStreamParser
 from libs.agent_interface import AgentInterface
 from libs.vector_storage import VectorStorage
 from pydantic import BaseModel, Field
 from libs.app_manager import AppManager
+from libs.tool_call_archive import ToolCallArchive, ToolCallRetentionPolicy
+from libs.context_builder import ContextBuilder, ContextBudget, BuiltContext, shared_prefix_tokens, MESSAGE_OVERHEAD_TOKENS
+from tools.tool_history import ToolHistory
 from datetime import datetime
 import asyncio
+import time
+import traceback
 import uuid
 from sqlmodel import SQLModel, Field
 from typing import Optional, List, Dict
@@ -16,6 +22,27 @@ from datetime import datetime
 from sqlmodel import SQLModel, Field
 import json
 
+# typed property name -> (backing JSON column, item model)
+TYPED_LIST_FIELDS = {
+    "pre_inference_tool_calls": ("pre_inference_tool_calls_str", ToolCall),
+    "post_inference_tool_calls": ("post_inference_tool_calls_str", ToolCall),
+    "standing_tool_call_results": ("standing_tool_call_results_str", ToolCallResult),
+    "tool_call_results": ("tool_call_results_str", ToolCallResult),
+    "pending_tool_calls": ("pending_tool_calls_str", ToolCall),
+}
+
+def _to_model(model_class, value):
+    if isinstance(value, model_class):
+        return value
+    if isinstance(value, str):
+        return model_class.model_validate_json(value)
+    return model_class.model_validate(value)
+
+def _matches(tool_call: ToolCall, tool_name: str, toolset_id: str = None) -> bool:
+    if toolset_id:
+        return tool_call.name == tool_name and tool_call.toolset_id == toolset_id
+    return tool_call.name == tool_name
+
 class AgentStateDBO(SQLModel, table=True):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     description: str = Field(default="")
@@ -55,141 +82,119 @@ class AgentStateDBO(SQLModel, table=True):
             tools = [tool for tool in tools if tool.name != tool_name]
         self.available_tools = tools
     
+    ############### Typed list fields ###############
+    # The *_str columns hold JSON lists of JSON strings. They are decoded once into typed lists that are
+    # mutated in place, and written back to the columns by sync_typed_fields() when the state is saved.
+    def _typed_list(self, name: str) -> List:
+        typed_lists = self.__dict__.setdefault("_typed_lists", {})
+        if name not in typed_lists:
+            column, model_class = TYPED_LIST_FIELDS[name]
+            raw = getattr(self, column)
+            typed_lists[name] = [_to_model(model_class, value) for value in (json.loads(raw) if raw else [])]
+        return typed_lists[name]
+
+    def _set_typed_list(self, name: str, value: List):
+        _, model_class = TYPED_LIST_FIELDS[name]
+        self.__dict__.setdefault("_typed_lists", {})[name] = [_to_model(model_class, item) for item in value]
+
+    def snapshot(self) -> "AgentStateDBO":
+        """Independent copy for tools running in worker threads, so the next pass can change the live state meanwhile"""
+        state = AgentStateDBO.model_validate(self.model_dump())
+        typed_lists = state.__dict__.setdefault("_typed_lists", {})
+        # lists changed since the last sync are newer than their columns
+        for name, values in self.__dict__.get("_typed_lists", {}).items():
+            typed_lists[name] = [value.model_copy(deep=True) for value in values]
+        return state
+
+    def sync_typed_fields(self):
+        """Serialize the materialized typed lists back into their *_str columns"""
+        for name, values in self.__dict__.get("_typed_lists", {}).items():
+            column, _ = TYPED_LIST_FIELDS[name]
+            setattr(self, column, json.dumps([value.model_dump_json() for value in values]))
+
     @property
-    def pre_inference_tool_calls(self) -> List:
-        return json.loads(self.pre_inference_tool_calls_str) if self.pre_inference_tool_calls_str else []
+    def pre_inference_tool_calls(self) -> List[ToolCall]:
+        return self._typed_list("pre_inference_tool_calls")
     
     @pre_inference_tool_calls.setter
     def pre_inference_tool_calls(self, value: List):
-        self.pre_inference_tool_calls_str = json.dumps([tool.model_dump_json() for tool in value])
+        self._set_typed_list("pre_inference_tool_calls", value)
     
     def append_pre_inference_tool_call(self, tool_call: ToolCall):
-        calls = self.pre_inference_tool_calls
-        calls.append(tool_call)
-        self.pre_inference_tool_calls = calls
+        self.pre_inference_tool_calls.append(tool_call)
     
     def remove_pre_inference_tool_call(self, tool_name: str, toolset_id: str = None):
         calls = self.pre_inference_tool_calls
-        if toolset_id:
-            calls = [call for call in calls if not (call.name == tool_name and call.toolset_id == toolset_id)]
-        else:
-            calls = [call for call in calls if call.name != tool_name]
-        self.pre_inference_tool_calls = calls
+        calls[:] = [call for call in calls if not _matches(call, tool_name, toolset_id)]
     
     @property
-    def post_inference_tool_calls(self) -> List:
-        return json.loads(self.post_inference_tool_calls_str) if self.post_inference_tool_calls_str else []
+    def post_inference_tool_calls(self) -> List[ToolCall]:
+        return self._typed_list("post_inference_tool_calls")
     
     @post_inference_tool_calls.setter
     def post_inference_tool_calls(self, value: List):
-        self.post_inference_tool_calls_str = json.dumps([tool.model_dump_json() for tool in value])
+        self._set_typed_list("post_inference_tool_calls", value)
     
     def append_post_inference_tool_call(self, tool_call: ToolCall):
-        calls = self.post_inference_tool_calls
-        calls.append(tool_call)
-        self.post_inference_tool_calls = calls
+        self.post_inference_tool_calls.append(tool_call)
     
     def remove_post_inference_tool_call(self, tool_name: str, toolset_id: str = None):
         calls = self.post_inference_tool_calls
-        if toolset_id:
-            calls = [call for call in calls if not (call.name == tool_name and call.toolset_id == toolset_id)]
-        else:
-            calls = [call for call in calls if call.name != tool_name]
-        self.post_inference_tool_calls = calls
+        calls[:] = [call for call in calls if not _matches(call, tool_name, toolset_id)]
     
     @property
-    def standing_tool_call_results(self) -> List:
-        return json.loads(self.standing_tool_call_results_str) if self.standing_tool_call_results_str else []
+    def standing_tool_call_results(self) -> List[ToolCallResult]:
+        return self._typed_list("standing_tool_call_results")
     
     @standing_tool_call_results.setter
     def standing_tool_call_results(self, value: List):
-        
-        results = []
-        for tool_result in value:
-            if isinstance(tool_result, ToolCallResult):
-                results.append(tool_result.model_dump_json())
-            else:
-                results.append(tool_result)
-        
-        self.standing_tool_call_results_str = json.dumps(results)
+        self._set_typed_list("standing_tool_call_results", value)
     
     def append_standing_tool_call_result(self, tool_result: ToolCallResult):
-        results = self.standing_tool_call_results
-        results.append(tool_result)
-        self.standing_tool_call_results = results
+        self.standing_tool_call_results.append(tool_result)
     
     def remove_standing_tool_call_result(self, tool_name: str, toolset_id: str = None):
         results = self.standing_tool_call_results
-        if toolset_id:
-            results = [result for result in results 
-                      if not (result.tool_call.name == tool_name and result.tool_call.toolset_id == toolset_id)]
-        else:
-            results = [result for result in results if result.tool_call.name != tool_name]
-        self.standing_tool_call_results = results
+        results[:] = [result for result in results if not _matches(result.tool_call, tool_name, toolset_id)]
     
     def clear_standing_tool_call_results(self):
-        self.standing_tool_call_results = []
+        self.standing_tool_call_results.clear()
     
     @property
-    def tool_call_results(self) -> List:
-        return json.loads(self.tool_call_results_str) if self.tool_call_results_str else []
+    def tool_call_results(self) -> List[ToolCallResult]:
+        return self._typed_list("tool_call_results")
     
     @tool_call_results.setter
     def tool_call_results(self, value: List):
-        results = []
-        for tool_result in value:
-            if isinstance(tool_result, ToolCallResult):
-                results.append(tool_result.model_dump_json())
-            else:
-                results.append(tool_result)
-        self.tool_call_results_str = json.dumps(results)
+        self._set_typed_list("tool_call_results", value)
     
     def append_tool_call_result(self, tool_result: ToolCallResult):
-        results = self.tool_call_results
-        results.append(tool_result.model_dump_json())
-        self.tool_call_results = results
+        self.tool_call_results.append(tool_result)
     
     def remove_tool_call_result(self, tool_name: str, toolset_id: str = None):
         results = self.tool_call_results
-        if toolset_id:
-            results = [result for result in results 
-                      if not (result.tool_call.name == tool_name and result.tool_call.toolset_id == toolset_id)]
-        else:
-            results = [result for result in results if result.tool_call.name != tool_name]
-        self.tool_call_results = results
+        results[:] = [result for result in results if not _matches(result.tool_call, tool_name, toolset_id)]
     
     def clear_tool_call_results(self):
-        self.tool_call_results = []
+        self.tool_call_results.clear()
     
     @property
-    def pending_tool_calls(self) -> List:
-        return json.loads(self.pending_tool_calls_str) if self.pending_tool_calls_str else []
+    def pending_tool_calls(self) -> List[ToolCall]:
+        return self._typed_list("pending_tool_calls")
     
     @pending_tool_calls.setter
     def pending_tool_calls(self, value: List):
-        self.pending_tool_calls_str = json.dumps([tool.model_dump_json() for tool in value])
+        self._set_typed_list("pending_tool_calls", value)
     
     def append_pending_tool_call(self, tool_call: ToolCall):
-        calls = self.pending_tool_calls
-        calls.append(tool_call)
-        self.pending_tool_calls = calls
+        self.pending_tool_calls.append(tool_call)
     
     def remove_pending_tool_call(self, tool_name: str, toolset_id: str = None):
-        calls = []
-        for call in self.pending_tool_calls:
-            if isinstance(call, str):
-                call = ToolCall.model_validate_json(call)
-            if toolset_id:
-                if call.name == tool_name and call.toolset_id == toolset_id:
-                    continue
-            else:
-                if call.name == tool_name:
-                    continue
-            calls.append(call)
-        self.pending_tool_calls = calls
+        calls = self.pending_tool_calls
+        calls[:] = [call for call in calls if not _matches(call, tool_name, toolset_id)]
     
     def clear_pending_tool_calls(self):
-        self.pending_tool_calls = []
+        self.pending_tool_calls.clear()
     
     @property
     def app_keys(self) -> Dict:
@@ -241,6 +246,16 @@ class Agent:
         self.sqlite_db_path = "sqlite_db.db"
         self.ollama_server = "http://localhost:11434"
         self.embedding_model = "nomic-embed-text"
+        self.tool_call_retention = ToolCallRetentionPolicy()
+        # default timeout in seconds for long running tools whose schema doesn't set one, None waits forever
+        self.background_tool_timeout = None
+        # when set, passes don't wait for long running tools, their results are delivered on a later pass
+        self.detach_background_tools = False
+        # token budgets for the prompt, and room left on top of it for the response
+        self.context_budget = ContextBudget()
+        self.max_response_tokens = 4096
+        # stream the response and start each tool call as soon as it has been generated
+        self.stream_inference = False
         if init_keys is not None:
             if "chroma_db_path" in init_keys:
                 self.chroma_db_path = init_keys["chroma_db_path"]
@@ -254,7 +269,36 @@ class Agent:
                 self.persona_name = init_keys["persona_name"]
             if "persona_description" in init_keys:
                 self.persona_description = init_keys["persona_description"]
+            if "max_tool_call_results" in init_keys:
+                self.tool_call_retention.max_results = init_keys["max_tool_call_results"]
+            if "tool_call_results_token_budget" in init_keys:
+                self.tool_call_retention.token_budget = init_keys["tool_call_results_token_budget"]
+            if "background_tool_timeout" in init_keys:
+                self.background_tool_timeout = init_keys["background_tool_timeout"]
+            if "detach_background_tools" in init_keys:
+                self.detach_background_tools = init_keys["detach_background_tools"]
+            if "context_budget" in init_keys:
+                self.context_budget = ContextBudget(**init_keys["context_budget"])
+            if "max_response_tokens" in init_keys:
+                self.max_response_tokens = init_keys["max_response_tokens"]
+            if "stream_inference" in init_keys:
+                self.stream_inference = init_keys["stream_inference"]
         
+        # set by the scheduler to cap in-flight inference requests across agents
+        self.inference_semaphore: Optional[asyncio.Semaphore] = None
+        # running long running tool tasks, so they can be cancelled
+        self.background_tasks = set()
+        # results of detached tools that finished since the last pass, (tool call, result)
+        self.completed_background_results = []
+        # previous prompt, to measure how much of each prompt the server could reuse
+        self.last_prompt_messages: List[Message] = []
+        self.prompt_prefix_stats = {}
+        # set when the last pass was skipped because inference failed
+        self.last_inference_error: Optional[Exception] = None
+        # seconds spent in each phase of the last pass (pre_inference_tools, build_context, inference,
+        # post_inference_tools, save_state), phases that didn't run are missing
+        self.pass_timings: Dict[str, float] = {}
+
         self.state = AgentStateDBO.new_agent_state(base_system_prompt)
         if id is not None:
             self.state.id = id
@@ -269,6 +313,10 @@ class Agent:
         for app in apps:
             self.app_manager.add_app(app)
 
+        # tool call results trimmed from the state are archived here, the agent can page them back in
+        self.tool_call_archive = ToolCallArchive(self.sqlite_db_path)
+        self.app_manager.add_app(ToolHistory(self.tool_call_archive))
+
         # add standing tool calls
         self.state.pre_inference_tool_calls = pre_inference_tool_calls
         self.state.post_inference_tool_calls = post_inference_tool_calls
@@ -285,136 +333,284 @@ class Agent:
             default_embedding_model=self.embedding_model,
         )
         
+    def apply_tool_call_retention(self):
+        """Move tool call results beyond the retention policy from the state to the archive"""
+        results = self.state.tool_call_results
+        to_archive, to_keep = self.tool_call_retention.split(results)
+        if len(to_archive) > 0:
+            self.tool_call_archive.archive(self.state.id, to_archive)
+            results[:] = to_keep
+
     def save_state(self):
-        # add or update the agent state
+        start_time = time.monotonic()
+        self.apply_tool_call_retention()
+        # write the typed lists back to their columns, then add or update the agent state
+        self.state.sync_typed_fields()
         self.agent_vector_storage.add(self.state, metadata_fields=["id", "created_at"])
+        self.pass_timings["save_state"] = time.monotonic() - start_time
 
     
     def load_state(self, agent_id: str):
         self.state = self.agent_vector_storage.get_by_id(agent_id)
+        # background tools don't survive a restart, pending calls left from a previous run would block those tools forever
+        if len(self.background_tasks) == 0:
+            self.state.clear_pending_tool_calls()
 
     @staticmethod
-    def get_agents(init_keys: Dict[str, str]):
-        agent_vector_storage = VectorStorage(
+    def get_agent_vector_storage(init_keys: Dict[str, str]) -> VectorStorage:
+        # cheap to build, engine/client/collection come from the shared registry
+        return VectorStorage(
             model_class=AgentStateDBO,
             chroma_db_path=init_keys["chroma_db_path"],
             sqlite_db_path=init_keys["sqlite_db_path"],
+            embed_field="description",
+            id_field="id",
+            collection_name="agent_state",
             ollama_server=init_keys["ollama_server"],
             default_embedding_model=init_keys["embedding_model"],
         )
-        return agent_vector_storage.get_all()
+
+    @staticmethod
+    def get_agents(init_keys: Dict[str, str]):
+        return Agent.get_agent_vector_storage(init_keys).get_all()
     
     @staticmethod
     def get_agent(init_keys: Dict[str, str], agent_id: str):
-        agent_vector_storage = VectorStorage(
-            model_class=AgentStateDBO,
-            chroma_db_path=init_keys["chroma_db_path"],
-            sqlite_db_path=init_keys["sqlite_db_path"],
-            ollama_server=init_keys["ollama_server"],
-            default_embedding_model=init_keys["embedding_model"],
-        )
-        return agent_vector_storage.get(agent_id)
+        return Agent.get_agent_vector_storage(init_keys).get_by_id(agent_id)
     
     @staticmethod
     def get_agent_ids(init_keys: Dict[str, str], limit: int = 10):
-        agent_vector_storage = VectorStorage(
-            model_class=AgentStateDBO,
-            chroma_db_path=init_keys["chroma_db_path"],
-            sqlite_db_path=init_keys["sqlite_db_path"],
-            embed_field="description",
-            id_field="id",
-            collection_name="agent_state",
-            ollama_server=init_keys["ollama_server"],
-            default_embedding_model=init_keys["embedding_model"],
-        )
-        return [agent.id for agent in agent_vector_storage.get_all(limit=limit)]
+        return [agent.id for agent in Agent.get_agent_vector_storage(init_keys).get_all(limit=limit)]
 
     @staticmethod
-    def get_message_buffer(state: AgentStateDBO) -> List[Message]:
-        message_buffer = []
-        
-        # available tools
-        message_buffer.append(Message(role="assistant", content=state.available_tools_str))
+    def add_state_sections(builder: ContextBuilder, state: AgentStateDBO):
+        # ordered from most to least stable, so consecutive passes share as long a prompt prefix as possible:
+        # the catalog only changes when apps are (un)loaded, tool results are append-only,
+        # standing results and pending calls are redone every pass
 
-        # standing tool call results
-        if len(state.standing_tool_call_results) > 0:
-            for tool_result in state.standing_tool_call_results:
-                if type(tool_result) == str:
-                    tool_result = ToolCallResult.model_validate_json(tool_result)
-                    
-                if tool_result.result and len(tool_result.result) > 0:
-                    message_buffer.append(Message(role="assistant", content=f"{tool_result.result}"))
+        # available tools
+        builder.add_section("catalog", [[Message(role="assistant", content=state.available_tools_str)]], trimmable=False)
 
         # tool call results
-        if len(state.tool_call_results) > 0:
-            for tool_result in state.tool_call_results:
-                if type(tool_result) == str:
-                    tool_result = ToolCallResult.model_validate_json(tool_result)
-                    
-                if tool_result.result and len(tool_result.result) > 0:
-                    message_buffer.append(Message(role="assistant", content=f"Called: {tool_result.tool_call.toolset_id} {tool_result.tool_call.name}({tool_result.tool_call.arguments})"))
-                    message_buffer.append(Message(role="tool", content=f"Tool result: {tool_result.result}"))
+        builder.add_section("history", [
+            [
+                Message(role="assistant", content=f"Called: {tool_result.tool_call.toolset_id} {tool_result.tool_call.name}({tool_result.tool_call.arguments})"),
+                Message(role="tool", content=f"Tool result: {tool_result.result}")
+            ]
+            for tool_result in state.tool_call_results
+            if tool_result.result and len(tool_result.result) > 0
+        ], omitted_label="tool results")
+
+        # standing tool call results
+        builder.add_section("standing_results", [
+            [Message(role="assistant", content=f"{tool_result.result}")]
+            for tool_result in state.standing_tool_call_results
+            if tool_result.result and len(tool_result.result) > 0
+        ], omitted_label="standing results")
 
         # pending tool calls
-        if len(state.pending_tool_calls) > 0:
-            for tool_call in state.pending_tool_calls:
-                if type(tool_call) == str:
-                    tool_call = ToolCall.model_validate_json(tool_call)
-                message_buffer.append(Message(role="assistant", content=f"Pending tool call: {tool_call.toolset_id} {tool_call.name}({tool_call.arguments})"))
+        builder.add_section("pending_calls", [
+            [Message(role="assistant", content=f"Pending tool call: {tool_call.toolset_id} {tool_call.name}({tool_call.arguments})")]
+            for tool_call in state.pending_tool_calls
+        ], omitted_label="pending tool calls")
+
+    @staticmethod
+    def get_message_buffer(state: AgentStateDBO, budget: Optional[ContextBudget] = None) -> List[Message]:
+        builder = ContextBuilder(budget)
+        Agent.add_state_sections(builder, state)
+        return builder.build().messages
 
-        return message_buffer
+    def build_context(self) -> BuiltContext:
+        builder = ContextBuilder(self.context_budget)
+        # the response format never changes, so it goes up front with the system prompt
+        final_system_prompt = self.state.base_system_prompt
+        final_system_prompt += "\n\n" + f"Please respond in the following format: \n{AgentRunSchema.model_json_schema()}"
+        builder.add_message("system_prompt", Message(role="system", content=final_system_prompt))
+        self.add_state_sections(builder, self.state)
+        # next instruction, and the current time, which changes every pass, go last
+        final_next_instruction = f"Current time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        if self.state.next_instruction:
+            final_next_instruction += "\n\nInstructions you wrote for yourself from your previous pass:\n"
+            final_next_instruction += self.state.next_instruction
+        builder.add_message("instruction", Message(role="user", content=f"{final_next_instruction}"))
+        return builder.build()
 
-    async def run_background_tool(self, tool_call: ToolCall):
+    def record_prompt_prefix(self, messages: List[Message]):
+        """Measure how much of this prompt matches the start of the previous one, i.e. what the server can reuse"""
+        shared = shared_prefix_tokens(self.last_prompt_messages, messages)
+        total = sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(message.content) for message in messages)
+        self.prompt_prefix_stats = {"shared_tokens": shared, "total_tokens": total, "shared_ratio": shared / total if total > 0 else 0.0}
+        self.last_prompt_messages = messages
+        print(f"Prompt prefix shared with previous pass: {shared}/{total} tokens ({self.prompt_prefix_stats['shared_ratio']:.1%})")
+
+    async def run_background_tool(self, tool_call: ToolCall, timeout: Optional[float] = None, state: Optional[AgentStateDBO] = None):
+        # the call was added to pending_tool_calls by start_background_tool
+        state = state if state is not None else self.state.snapshot()
+        try:
+            # long running tools get their own bounded pool (or are awaited natively) so they really overlap
+            tool_result = await self.app_manager.run_tool_async(tool_call, state, background=True, timeout=timeout)
+        except asyncio.TimeoutError:
+            # the worker thread can't be interrupted, its result is dropped when it finishes
+            print(f"Background tool {tool_call.toolset_id}.{tool_call.name} timed out after {timeout}s")
+            tool_result = ToolCallResult(toolset_id=tool_call.toolset_id, tool_call=tool_call, error=f"Timed out after {timeout}s")
+        except asyncio.CancelledError:
+            self.state.remove_pending_tool_call(tool_call.name, tool_call.toolset_id)
+            raise
+        except Exception as e:
+            print(f"Background tool {tool_call.toolset_id}.{tool_call.name} failed")
+            print(traceback.format_exc())
+            tool_result = ToolCallResult(toolset_id=tool_call.toolset_id, tool_call=tool_call, error=str(e))
+
+        if self.detach_background_tools:
+            # the pass that started this may be long gone, hold the result until the next pass picks it up
+            self.completed_background_results.append((tool_call, tool_result))
+        else:
+            self.state.append_tool_call_result(tool_result)
+            self.state.remove_pending_tool_call(tool_call.name, tool_call.toolset_id)
+        return tool_result  # Return the tool result so it can be awaited
+
+    def deliver_background_results(self):
+        """Move results of detached tools that finished since the last pass into tool_call_results"""
+        completed = self.completed_background_results
+        self.completed_background_results = []
+        for tool_call, tool_result in completed:
+            self.state.append_tool_call_result(tool_result)
+            self.state.remove_pending_tool_call(tool_call.name, tool_call.toolset_id)
+        if len(completed) > 0:
+            print(f"Delivered {len(completed)} background tool results, {len(self.background_tasks)} still running")
+
+    def start_background_tool(self, tool_call: ToolCall, tool_schema: ToolSchema) -> Optional[asyncio.Task]:
         # if tool is already pending, by name and toolset_id, skip
-        # otherwise these would stack up
+        # otherwise these would stack up. marked pending here rather than in the task,
+        # so the state is right even if the pass ends before the task gets to run
         if any(call.name == tool_call.name and call.toolset_id == tool_call.toolset_id for call in self.state.pending_tool_calls):
             return None
+        self.state.append_pending_tool_call(tool_call)
+
+        timeout = tool_schema.timeout if tool_schema.timeout is not None else self.background_tool_timeout
+        # the tool reads a copy of the state as it is now, it runs in a worker thread while later passes change the live one
+        task = asyncio.ensure_future(self.run_background_tool(tool_call, timeout=timeout, state=self.state.snapshot()))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def cancel_background_tools(self):
+        """Cancel every running background tool. Tools already running in a worker thread finish there, but their results are dropped."""
+        for task in list(self.background_tasks):
+            task.cancel()
+
+    async def run_inference(self, message_buffer: List[Message], num_ctx: Optional[int] = None) -> str:
+        # inference runs in a worker thread so other agents on the loop keep going while this one waits
+        # responses that don't validate are retried by call_ollama_chat
+        options = {"json_schema": AgentRunSchema.model_json_schema(), "response_model": AgentRunSchema}
+        if num_ctx is not None:
+            options["num_ctx"] = num_ctx
+        if self.inference_semaphore is None:
+            return await asyncio.to_thread(call_ollama_chat, self.state.llm_server_url, self.state.llm_model, message_buffer, **options)
+        async with self.inference_semaphore:
+            return await asyncio.to_thread(call_ollama_chat, self.state.llm_server_url, self.state.llm_model, message_buffer, **options)
+
+    async def run_inference_streaming(self, message_buffer: List[Message], tool_call_queue: asyncio.Queue, num_ctx: Optional[int] = None) -> str:
+        # tool calls are put on the queue as soon as they are complete, while the rest of the response is still generating
+        parser = ToolCallStreamParser(tool_call_queue.put_nowait)
+
+        async def stream():
+            async for chunk in stream_ollama_chat(self.state.llm_server_url, self.state.llm_model, message_buffer, json_schema=AgentRunSchema.model_json_schema(), num_ctx=num_ctx):
+                parser.feed(chunk)
+
+        if self.inference_semaphore is None:
+            await stream()
         else:
-            self.state.append_pending_tool_call(tool_call)
+            async with self.inference_semaphore:
+                await stream()
+        for error in parser.errors:
+            print(error)
+        return parser.text
 
-        tool_result = self.app_manager.run_tool(tool_call, self.state)
-        self.state.append_tool_call_result(tool_result)
-        self.state.remove_pending_tool_call(tool_call.name, tool_call.toolset_id)
-        return tool_result  # Return the tool result so it can be awaited
+    async def dispatch_tool_call(self, tool_call: ToolCall, background_tasks: List[asyncio.Task]):
+        print(f"Tool call: {tool_call.name} {tool_call.toolset_id} {tool_call.arguments}")
+        
+        tool_schema = self.app_manager.get_tool_schema(tool_call.toolset_id, tool_call.name)
+        if not tool_schema:
+            print(f"Tool call {tool_call.name} not found")
+            return
+        
+        if tool_schema and tool_schema.is_long_running:
+            task = self.start_background_tool(tool_call, tool_schema)
+            if task is not None:
+                background_tasks.append(task)
+        else:
+            tool_result = await self.app_manager.run_tool_async(tool_call, self.state)
+            self.state.append_tool_call_result(tool_result)
+
+    async def dispatch_tool_calls_from_queue(self, tool_call_queue: asyncio.Queue, background_tasks: List[asyncio.Task]):
+        # one at a time and in order, a call may depend on an earlier one (e.g. load_app), None ends the queue
+        while True:
+            tool_call = await tool_call_queue.get()
+            if tool_call is None:
+                return
+            await self.dispatch_tool_call(tool_call, background_tasks)
 
     async def run_pass_async(self):
         print("~"*100)
         print("Running pass")
-        self.state.available_tools = self.app_manager.get_available_tools()
-        self.state.available_tools_str = self.app_manager.list_apps() + "\n" + self.app_manager.get_loaded_apps()
+        self.pass_timings = {}
+        phase_start = time.monotonic()
+        self.deliver_background_results()
+        # the rendered catalog, not the schema list, is what goes in the prompt, cached until the loaded apps change
+        self.state.available_tools_str = self.app_manager.get_tool_catalog()
 
-        # run pre-inference tool calls
+        # run pre-inference tool calls concurrently, blocking tools run in the tool thread pool
+        pre_inference_tasks = []
         for tool_call in self.state.pre_inference_tool_calls:
-            
-            if type(tool_call) == str:
-                tool_call = ToolCall.model_validate_json(tool_call)
-
             print(f"Pre-inference tool call: {tool_call.name} {tool_call.toolset_id} {tool_call.arguments}")
-            # note: if tool is long running, it will block the main thread
-
-            tool_result = self.app_manager.run_tool(tool_call, self.state)
+            pre_inference_tasks.append(self.app_manager.run_tool_async(tool_call, self.state))
 
+        # gather keeps the declared order, so standing results land in the same order as before
+        for tool_result in await asyncio.gather(*pre_inference_tasks):
             self.state.append_standing_tool_call_result(tool_result)
+        phase_start = self.record_pass_timing("pre_inference_tools", phase_start)
 
-        final_message_buffer = []
-        final_system_prompt = self.state.base_system_prompt
-
-        final_message_buffer.append(Message(role="system", content=final_system_prompt))
-
-        # get message buffer
-        final_message_buffer.extend(self.get_message_buffer(self.state))
+        # system prompt, tools, results, pending calls and instruction, trimmed to the context budget
+        context = self.build_context()
+        print(f"Context: {context.summary()}")
+        self.record_prompt_prefix(context.messages)
         # clear standing_tool_call_results
-        self.state.standing_tool_call_results = []
-        # next instruction
-        if self.state.next_instruction:
-            final_next_instruction = "Instructions you wrote for yourself from your previous pass:\n"
-            final_next_instruction += self.state.next_instruction
-            final_next_instruction += "\n\n" + f"Please respond in the following format: \n{AgentRunSchema.model_json_schema()}"
-            final_message_buffer.append(Message(role="user", content=f"{final_next_instruction}"))
+        self.state.clear_standing_tool_call_results()
+        phase_start = self.record_pass_timing("build_context", phase_start)
+
+        background_tasks = []
 
         # inference:
-        llm_response = call_ollama_chat(self.state.llm_server_url, self.state.llm_model, final_message_buffer, json_schema=AgentRunSchema.model_json_schema())
-        agent_run_schema = AgentRunSchema.model_validate_json(llm_response)
+        num_ctx = context.total_tokens + self.max_response_tokens
+        try:
+            if self.stream_inference:
+                # the agent's tool calls run while the rest of the response (follow up thoughts, next instruction) is generated
+                tool_call_queue = asyncio.Queue()
+                dispatcher = asyncio.ensure_future(self.dispatch_tool_calls_from_queue(tool_call_queue, background_tasks))
+                try:
+                    llm_response = await self.run_inference_streaming(context.messages, tool_call_queue, num_ctx=num_ctx)
+                finally:
+                    # let the calls that were already generated finish either way
+                    tool_call_queue.put_nowait(None)
+                    await dispatcher
+                try:
+                    agent_run_schema = AgentRunSchema.model_validate_json(llm_response)
+                except ValueError as e:
+                    # can't retry a streamed response, its tool calls have already run
+                    raise InferenceError(f"Streamed response did not validate: {e}", server_url=self.state.llm_server_url, attempts=1, cause=e)
+            else:
+                llm_response = await self.run_inference(context.messages, num_ctx=num_ctx)
+                agent_run_schema = AgentRunSchema.model_validate_json(llm_response)
+        except InferenceError as e:
+            # skip this agent for the round, its state is kept as is for the next one
+            print(f"Inference failed for agent {self.state.id}, skipping this pass: {e}")
+            self.last_inference_error = e
+            self.record_pass_timing("inference", phase_start)
+            return
+        self.last_inference_error = None
+        # when streaming this includes the agent's own tool calls, which run during inference
+        phase_start = self.record_pass_timing("inference", phase_start)
         print()
         print("="*100)
         print(f"Agent run result:")
@@ -428,44 +624,40 @@ class Agent:
         # post-inference:
         self.state.next_instruction = agent_run_schema.detailed_next_instruction
 
-        tool_schemas = self.app_manager.get_all_tool_schemas()
-        background_tasks = []
-
-        # Create background tasks for agent's tool calls
-        for tool_call in agent_run_schema.tool_calls:
-            print(f"Tool call: {tool_call.name} {tool_call.toolset_id} {tool_call.arguments}")
-            
-            tool_schema = next((schema for schema in tool_schemas if (schema.name == tool_call.name and schema.toolset_id == tool_call.toolset_id)), None)
-            if not tool_schema:
-                print(f"Tool call {tool_call.name} not found")
-                continue
-            
-            if tool_schema and tool_schema.is_long_running:
-                background_tasks.append(self.run_background_tool(tool_call))
-            else:
-                tool_result = self.app_manager.run_tool(tool_call, self.state)
-                self.state.append_tool_call_result(tool_result)
+        # Create background tasks for agent's tool calls, when streaming they have already been dispatched
+        if not self.stream_inference:
+            for tool_call in agent_run_schema.tool_calls:
+                await self.dispatch_tool_call(tool_call, background_tasks)
 
         # Create background tasks for post-inference tool calls
         for tool_call in self.state.post_inference_tool_calls:
-            if type(tool_call) == str:
-                tool_call = ToolCall.model_validate_json(tool_call)
-            tool_schema = next((schema for schema in tool_schemas if (schema.name == tool_call.name and schema.toolset_id == tool_call.toolset_id)), None)
+            tool_schema = self.app_manager.get_tool_schema(tool_call.toolset_id, tool_call.name)
             if not tool_schema:
                 print(f"Tool call {tool_call} not found")
                 continue
             print(f"Post-inference tool call: {tool_call.name} {tool_call.toolset_id} {tool_call.arguments}")
             if tool_schema.is_long_running:
-                background_tasks.append(self.run_background_tool(tool_call))
+                task = self.start_background_tool(tool_call, tool_schema)
+                if task is not None:
+                    background_tasks.append(task)
             else:
-                tool_result = self.app_manager.run_tool(tool_call, self.state)
+                tool_result = await self.app_manager.run_tool_async(tool_call, self.state)
                 self.state.append_standing_tool_call_result(tool_result)
                 
-        # Await all background tasks to complete
-        if background_tasks:
-            # Using gather instead of as_completed to wait for all tasks to complete
-            await asyncio.gather(*background_tasks)
+        # Await all background tasks to complete, unless they are detached and left running past this pass
+        if background_tasks and not self.detach_background_tools:
+            # Using gather instead of as_completed to wait for all tasks to complete,
+            # cancelled tasks are skipped rather than failing the pass
+            await asyncio.gather(*background_tasks, return_exceptions=True)
             # Note: No need to add results here as they are already added in run_background_tool
+        self.record_pass_timing("post_inference_tools", phase_start)
+
+    def record_pass_timing(self, phase: str, phase_start: float) -> float:
+        """Record the time since phase_start for phase, returns now as the start of the next phase"""
+        now = time.monotonic()
+        self.pass_timings[phase] = now - phase_start
+        return now
+
     def run_pass(self):
         """
         Synchronous wrapper for the asynchronous run_pass_async method.
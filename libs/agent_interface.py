@@ -5,6 +5,10 @@ from libs.common import ToolCall, ToolCallResult, ToolSchema, ToolsetDetails
 from typing import List
 
 class AgentInterface(ABC):
+    # Apps may also define
+    #     async def agent_tool_callback_async(self, agent_state, tool_call: ToolCall) -> ToolCallResult
+    # AppManager.run_tool_async awaits it directly instead of running agent_tool_callback in a worker thread.
+
     @abstractmethod
     def get_toolset_details(self) -> ToolsetDetails:
         pass
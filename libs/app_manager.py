@@ -1,13 +1,47 @@
-from libs.common import ToolSchema, ToolCall, ToolsetDetails, get_tool_schemas_from_class, ToolCallResult
+from libs.common import ToolSchema, ToolCall, ToolsetDetails, get_tool_schemas_from_class, agent_tool, ToolCallResult, ollama_request_timeout
 from libs.agent_interface import AgentInterface
-from typing import List
+from typing import List, Optional, Dict, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
 import traceback
+
+# shared worker pools for blocking tool callbacks, so they don't stall the event loop.
+# long running tools get their own pool so they can't starve the short ones.
+_tool_executor_sizes = {"tool": 16, "background": 8}
+_tool_executors = {}
+_tool_executor_lock = threading.Lock()
+
+def configure_tool_executor(max_workers: Optional[int] = None, max_background_workers: Optional[int] = None):
+    with _tool_executor_lock:
+        if max_workers is not None:
+            _tool_executor_sizes["tool"] = max_workers
+        if max_background_workers is not None:
+            _tool_executor_sizes["background"] = max_background_workers
+        for executor in _tool_executors.values():
+            executor.shutdown(wait=False)
+        _tool_executors.clear()
+
+def get_tool_executor(background: bool = False) -> ThreadPoolExecutor:
+    kind = "background" if background else "tool"
+    with _tool_executor_lock:
+        if kind not in _tool_executors:
+            _tool_executors[kind] = ThreadPoolExecutor(max_workers=_tool_executor_sizes[kind], thread_name_prefix=f"agent-{kind}")
+        return _tool_executors[kind]
+
 class AppManager:
     def __init__(self):
         self.apps = {}
         self.schemas = {}
+        # (toolset_id, tool name) -> schema, and -> the app's (callback, async callback or None), kept in step by add_app/remove_app
+        self.tool_index: Dict[Tuple[str, str], ToolSchema] = {}
+        self.tool_callbacks: Dict[Tuple[str, str], Tuple[Callable, Optional[Callable]]] = {}
         self.loaded_app_ids = [] # these are the tools that are currently available to the agent, app manager is always loaded
+        # rendered tool catalog per loaded app list, the app list itself only changes through add_app/remove_app
+        self.catalog_cache: Dict[Tuple[str, ...], str] = {}
         self.exposed_tools = get_tool_schemas_from_class(self)        
+        # bound once, so our own tool calls don't go through getattr
+        self.tool_methods = {tool_schema.name: getattr(self, tool_schema.name) for tool_schema in self.exposed_tools}
 
         self.add_app(self)
         self.load_app(None, "app_manager")
@@ -18,11 +52,34 @@ class AppManager:
         tool_schemas = agent_tool.get_tool_schemas()
         print(f"Adding app {toolset_details.toolset_id}")
         print(f"Tool schemas: {tool_schemas}")
+        if toolset_details.toolset_id in self.apps:
+            # replacing an app keeps it loaded if it was
+            self._unindex_app(toolset_details.toolset_id)
         self.apps[toolset_details.toolset_id] = agent_tool
         self.schemas[toolset_details.toolset_id] = tool_schemas
-    def remove_app(self, app_id: str):
+
+        callbacks = (agent_tool.agent_tool_callback, getattr(agent_tool, "agent_tool_callback_async", None))
+        for tool_schema in tool_schemas:
+            # index by the app's toolset_id, that's what tool calls are routed by
+            key = (toolset_details.toolset_id, tool_schema.name)
+            self.tool_index[key] = tool_schema
+            self.tool_callbacks[key] = callbacks
+        self.catalog_cache.clear()
+
+    def _unindex_app(self, app_id: str):
         self.apps.pop(app_id)
-        self.schemas.pop(app_id)
+        for tool_schema in self.schemas.pop(app_id):
+            self.tool_index.pop((app_id, tool_schema.name), None)
+            self.tool_callbacks.pop((app_id, tool_schema.name), None)
+        self.catalog_cache.clear()
+
+    def remove_app(self, app_id: str):
+        self._unindex_app(app_id)
+        if app_id in self.loaded_app_ids:
+            self.loaded_app_ids.remove(app_id)
+
+    def get_tool_schema(self, toolset_id: str, name: str) -> Optional[ToolSchema]:
+        return self.tool_index.get((toolset_id, name))
 
     def list_apps(self):
         result = "Available apps:\n"
@@ -33,18 +90,18 @@ class AppManager:
             app = self.apps[toolset_id]
             toolset_details = app.get_toolset_details()
             # get count of tools where expose_to_agent is true
-            tool_count = len([tool for tool in app.get_tool_schemas() if tool.expose_to_agent])
+            tool_count = len([tool for tool in self.schemas[toolset_id] if tool.expose_to_agent])
             if tool_count == 0:
                 continue
             if toolset_id in self.loaded_app_ids:
-                loaded_apps.append(toolset_details)
+                loaded_apps.append((toolset_details, tool_count))
             else:
-                unloaded_apps.append(toolset_details)
-        loaded_apps.sort(key=lambda x: x.name)
-        unloaded_apps.sort(key=lambda x: x.name)
-        for app in loaded_apps:
+                unloaded_apps.append((toolset_details, tool_count))
+        loaded_apps.sort(key=lambda x: x[0].name)
+        unloaded_apps.sort(key=lambda x: x[0].name)
+        for app, tool_count in loaded_apps:
             result += f"    [loaded] {app.toolset_id} - {app.name} - {app.description} - {tool_count} tools\n"
-        for app in unloaded_apps:
+        for app, tool_count in unloaded_apps:
             result += f"    [unloaded] {app.toolset_id} - {app.name} - {app.description} - {tool_count} tools\n"
 
         """
@@ -56,6 +113,7 @@ class AppManager:
 
         return result
     
+    @agent_tool
     def load_app(self, agent_state, toolset_id: str):
         """
         {
@@ -82,6 +140,7 @@ class AppManager:
         result = f"Loaded app {details.toolset_id} - {details.name}\n{self.get_app_tool_list(details.toolset_id)}"
         return result
 
+    @agent_tool
     def unload_app(self, agent_state, toolset_id: str):
         """
         {
@@ -132,9 +191,44 @@ class AppManager:
         #print(result)
         return result
     
+    def get_tool_callbacks(self, tool_call: ToolCall) -> Tuple[Callable, Optional[Callable]]:
+        callbacks = self.tool_callbacks.get((tool_call.toolset_id, tool_call.name))
+        if callbacks is None:
+            # not in the index, calls for tools an app doesn't list still go to the app as before
+            app = self.apps[tool_call.toolset_id]
+            callbacks = (app.agent_tool_callback, getattr(app, "agent_tool_callback_async", None))
+        return callbacks
+
+    def get_tool_catalog(self) -> str:
+        """The app list and the loaded apps' tools, as shown to the agent. Only re-rendered when the loaded apps change."""
+        key = tuple(self.loaded_app_ids)
+        if key not in self.catalog_cache:
+            self.catalog_cache[key] = self.list_apps() + "\n" + self.get_loaded_apps()
+        return self.catalog_cache[key]
+
     def run_tool(self, tool_call: ToolCall, agent_state):
         # run tool
-        return self.apps[tool_call.toolset_id].agent_tool_callback(agent_state, tool_call)
+        callback, _ = self.get_tool_callbacks(tool_call)
+        return callback(agent_state, tool_call)
+
+    def run_background_tool(self, tool_call: ToolCall, agent_state, timeout: Optional[float]):
+        # the worker thread outlives a timed out tool, bound its inference requests so it is freed too
+        with ollama_request_timeout(timeout):
+            return self.run_tool(tool_call, agent_state)
+
+    async def run_tool_async(self, tool_call: ToolCall, agent_state, background: bool = False, timeout: Optional[float] = None):
+        # apps with a native async callback are awaited, everything else runs in a tool thread pool
+        _, async_callback = self.get_tool_callbacks(tool_call)
+        if async_callback is not None:
+            call = async_callback(agent_state, tool_call)
+        else:
+            loop = asyncio.get_running_loop()
+            if background:
+                call = loop.run_in_executor(get_tool_executor(True), self.run_background_tool, tool_call, agent_state, timeout)
+            else:
+                call = loop.run_in_executor(get_tool_executor(False), self.run_tool, tool_call, agent_state)
+        # raises asyncio.TimeoutError, a native async tool is cancelled, a thread is left to finish on its own
+        return await asyncio.wait_for(call, timeout=timeout)
 
     def get_all_tool_schemas(self):
         result = []
@@ -158,7 +252,7 @@ class AppManager:
     
     def agent_tool_callback(self, agent_state, tool_call: ToolCall) -> ToolCallResult:
         # call the tool
-        result = getattr(self, tool_call.name)(agent_state, **tool_call.arguments)
+        result = self.tool_methods[tool_call.name](agent_state, **tool_call.arguments)
         return ToolCallResult(
             toolset_id="app_manager",
             tool_call=tool_call,
@@ -1,7 +1,15 @@
-from ollama import Client
+from ollama import Client, AsyncClient
+import httpx
 import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+import asyncio
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict, Callable, Type
+from libs.embedding_cache import get_embedding_cache
+from libs.llm_cache import get_llm_cache
 import difflib
 import base64
 import re
@@ -9,59 +17,624 @@ import traceback
 import json
 from datetime import datetime
 
-def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=None, tools=None):
-    try:
-        client = Client(
-            host=server_url
+class OllamaClientConfig(BaseModel):
+    timeout: Optional[float] = None # seconds per request, None waits forever like the stock client
+    connect_timeout: float = 10.0
+    max_connections: int = 32
+    max_keepalive_connections: int = 16
+    keepalive_expiry: float = 120.0
+
+# process-wide client registry, one pooled client per server url (and per request timeout override)
+_ollama_client_config = OllamaClientConfig()
+_ollama_clients: Dict[tuple, Client] = {}
+# httpx async clients are bound to the event loop they were first used on
+_async_ollama_clients = weakref.WeakKeyDictionary()
+_ollama_clients_lock = threading.Lock()
+# request timeout override for the current thread, see ollama_request_timeout
+_request_timeout = threading.local()
+
+def _ollama_client_kwargs(timeout: Optional[float] = None):
+    if timeout is None:
+        timeout = _ollama_client_config.timeout
+    return {
+        "timeout": httpx.Timeout(timeout, connect=_ollama_client_config.connect_timeout),
+        "limits": httpx.Limits(
+            max_connections=_ollama_client_config.max_connections,
+            max_keepalive_connections=_ollama_client_config.max_keepalive_connections,
+            keepalive_expiry=_ollama_client_config.keepalive_expiry
         )
-        # TODO: un hardcode model
-        response = client.chat(
-            #model='huggingface.co/unsloth/DeepSeek-R1-Distill-Qwen-14B-GGUF:Q8_0', 
-            # huggingface.co/bartowski/Qwen2.5-14B-Instruct-1M-GGUF
-            #model='MFDoom/deepseek-r1-tool-calling:14b',
-            #deepseek-r1:32b
-            #deepseek-r1:70b
-            model='huggingface.co/bartowski/Qwen_QwQ-32B-GGUF:Q8_0',
-            stream=False,
-            messages=[m.chat_ml() for m in messages],
-            format=json_schema,
-            tools=tools,
-            options={
-                'num_ctx':100000,
-                'seed': random.randint(0, 1000000)
-            })
-        
-        # catch for "limburg"
-        if "limburg" in response.message.content:
-            return call_ollama_chat(server_url, model, messages, json_schema=json_schema, temperature=temperature, tools=tools)
-        return response.message.content
+    }
 
-    except Exception as error:
-        print("~~~~~~~~~~~~~~~~~~~~~~~")
-        print("Error")
-        print(error)
-        # print the stack trace
-        print(traceback.format_exc())
-        print("~~~~~~~~~~~~~~~~~~~~~~~")
-        return error
+def configure_ollama_clients(**kwargs):
+    """Update the pool/timeout settings (see OllamaClientConfig). Existing clients are dropped and rebuilt on next use."""
+    global _ollama_client_config
+    _ollama_client_config = _ollama_client_config.model_copy(update=kwargs)
+    close_ollama_clients()
+
+@contextmanager
+def ollama_request_timeout(timeout: Optional[float]):
+    """
+    Sync requests made by this thread inside the block fail after timeout seconds without a response, whatever the
+    pooled clients' timeout. Used to bound the requests of background tools, whose worker thread is only freed once
+    its request returns.
+    """
+    previous = getattr(_request_timeout, "value", None)
+    _request_timeout.value = timeout
+    try:
+        yield
+    finally:
+        _request_timeout.value = previous
+
+def get_ollama_client(server_url) -> Client:
+    """Returns the shared, connection pooled client for server_url, for the thread's request timeout if one is set"""
+    timeout = getattr(_request_timeout, "value", None)
+    key = (server_url.rstrip('/'), timeout)
+    client = _ollama_clients.get(key)
+    if client is None:
+        with _ollama_clients_lock:
+            client = _ollama_clients.get(key)
+            if client is None:
+                client = Client(host=key[0], **_ollama_client_kwargs(timeout))
+                _ollama_clients[key] = client
+    return client
+
+def get_async_ollama_client(server_url) -> AsyncClient:
+    """Returns the shared AsyncClient for server_url on the running event loop"""
+    key = server_url.rstrip('/')
+    loop = asyncio.get_running_loop()
+    with _ollama_clients_lock:
+        loop_clients = _async_ollama_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = AsyncClient(host=key, **_ollama_client_kwargs())
+            loop_clients[key] = client
+    return client
+
+def close_ollama_clients():
+    """
+    Closes every pooled client. AsyncClients can only be closed on their own loop, that is scheduled for loops that
+    are still running, clients of stopped loops are dropped. Await aclose_ollama_clients before a loop shuts down instead.
+    """
+    with _ollama_clients_lock:
+        for client in _ollama_clients.values():
+            client._client.close()
+        _ollama_clients.clear()
+        async_clients = list(_async_ollama_clients.items())
+        _async_ollama_clients.clear()
+    for loop, loop_clients in async_clients:
+        if loop.is_running():
+            for client in loop_clients.values():
+                asyncio.run_coroutine_threadsafe(client._client.aclose(), loop)
+
+async def aclose_ollama_clients():
+    """Closes the pooled AsyncClients of the running event loop, await it before the loop shuts down"""
+    loop = asyncio.get_running_loop()
+    with _ollama_clients_lock:
+        loop_clients = _async_ollama_clients.pop(loop, {})
+    for client in loop_clients.values():
+        await client._client.aclose()
+
+class InferenceError(Exception):
+    """Raised when an LLM call fails for good, after retries, or straight away while the backend's circuit is open"""
+    def __init__(self, message: str, server_url: Optional[str] = None, attempts: int = 0, cause: Optional[BaseException] = None):
+        super().__init__(message)
+        self.server_url = server_url
+        self.attempts = attempts
+        self.cause = cause
+
+class RetryPolicy(BaseModel):
+    max_attempts: int = 3
+    base_delay: float = 0.5 # seconds before the first retry, doubled every attempt
+    max_delay: float = 8.0
+    jitter: float = 0.5 # the delay is randomly shortened by up to this fraction, so agents don't retry in lockstep
+
+    def get_delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * random.uniform(1.0 - self.jitter, 1.0)
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend after failure_threshold consecutive failures. After reset_timeout seconds one trial
+    call is let through (half open), success closes the circuit again, failure opens it for another reset_timeout.
+    A trial that ends without an answer either way (cancelled) is released with release_trial, and a trial still
+    unresolved after reset_timeout no longer blocks the next one.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            # opened_at is also when the current half open trial started
+            if self.state != "closed" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.opened_at = time.monotonic()
+                return True
+            # open, or half open with the trial call still in flight
+            return False
+
+    def is_available(self) -> bool:
+        """Like allow_request, without taking the half open trial slot"""
+        with self._lock:
+            return self.state == "closed" or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def release_trial(self):
+        """Call when a request ends with neither success nor failure, a half open trial goes back to open with the next trial due now"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+# inference retry settings and one circuit breaker per server url
+_retry_policy = RetryPolicy()
+_circuit_breaker_settings = {"failure_threshold": 5, "reset_timeout": 30.0}
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def configure_inference_resilience(retry_policy: Optional[RetryPolicy] = None, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+    global _retry_policy
+    if retry_policy is not None:
+        _retry_policy = retry_policy
+    if failure_threshold is not None:
+        _circuit_breaker_settings["failure_threshold"] = failure_threshold
+    if reset_timeout is not None:
+        _circuit_breaker_settings["reset_timeout"] = reset_timeout
+    with _ollama_clients_lock:
+        _circuit_breakers.clear()
+
+def get_circuit_breaker(server_url) -> CircuitBreaker:
+    key = server_url.rstrip('/')
+    with _ollama_clients_lock:
+        if key not in _circuit_breakers:
+            _circuit_breakers[key] = CircuitBreaker(**_circuit_breaker_settings)
+        return _circuit_breakers[key]
+
+class LLMBackend:
+    """One endpoint in the router's pool and what the router knows about it"""
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency_ewma: Optional[float] = None # seconds
+        self.models_available = set() # from /api/tags
+        self.models_loaded = set() # from /api/ps
+        self.reachable = True
+        self.last_refresh = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma": self.latency_ewma,
+            "reachable": self.reachable,
+            "models_loaded": sorted(self.models_loaded)
+        }
+
+def normalize_model_name(model: str) -> str:
+    """Ollama lists untagged models as name:latest, so "nomic-embed-text" and "nomic-embed-text:latest" are the same model"""
+    # a ':' before the last '/' is a registry port, not a tag
+    return model if ":" in model.rsplit("/", 1)[-1] else f"{model}:latest"
+
+class LLMRouter:
+    """
+    Spreads chat and embed calls over a pool of Ollama compatible endpoints.
+
+    Calls made to any url in the pool are sent to the least loaded healthy backend, preferring backends that have
+    the model loaded (/api/ps), then ones that have it available (/api/tags). Load is in-flight requests weighted by
+    an EWMA of request latency. Health comes from the per-backend circuit breakers. Model lists are refreshed in the
+    background every refresh_interval seconds, a backend that can't be reached is kept in the pool and tried again later.
+    """
+    def __init__(self, urls: List[str], refresh_interval: float = 30.0, latency_alpha: float = 0.2, refresh_timeout: float = 5.0):
+        """
+        Initialize the router.
+
+        Args:
+            urls: Base urls of the backends
+            refresh_interval: Seconds between model list refreshes
+            latency_alpha: Weight of the newest request in the latency EWMA
+            refresh_timeout: Timeout for the model list requests
+        """
+        if len(urls) == 0:
+            raise ValueError("LLMRouter needs at least one backend url")
+        self.backends: Dict[str, LLMBackend] = {}
+        for url in urls:
+            self.backends[url.rstrip('/')] = LLMBackend(url.rstrip('/'))
+        self.refresh_interval = refresh_interval
+        self.latency_alpha = latency_alpha
+        self.refresh_timeout = refresh_timeout
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def handles(self, server_url: str) -> bool:
+        return server_url.rstrip('/') in self.backends
+
+    def refresh_backend(self, backend: LLMBackend):
+        client = Client(host=backend.url, timeout=self.refresh_timeout)
+        try:
+            available = {normalize_model_name(model.model) for model in client.list().models}
+            loaded = {normalize_model_name(model.model) for model in client.ps().models}
+        except Exception as error:
+            if backend.reachable:
+                print(f"LLM backend {backend.url} unreachable: {error}")
+            backend.reachable = False
+        else:
+            backend.models_available = available
+            backend.models_loaded = loaded
+            backend.reachable = True
+        finally:
+            backend.last_refresh = time.monotonic()
+            client._client.close()
+
+    def refresh(self):
+        for backend in list(self.backends.values()):
+            self.refresh_backend(backend)
+
+    def _refresh_stale(self):
+        # never blocks a request, the refresh runs on its own thread
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or all(now - backend.last_refresh < self.refresh_interval for backend in self.backends.values()):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+        threading.Thread(target=run, daemon=True, name="llm-router-refresh").start()
+
+    def _score(self, backend: LLMBackend, model: Optional[str]):
+        # lower is better: model placement first, then load
+        model = normalize_model_name(model) if model is not None else None
+        if model is not None and model in backend.models_loaded:
+            placement = 0
+        elif model is not None and model in backend.models_available:
+            placement = 1
+        else:
+            placement = 2
+        latency = backend.latency_ewma if backend.latency_ewma is not None else 0.0
+        return (placement, (backend.in_flight + 1) * max(latency, 0.001), backend.in_flight)
+
+    def pick(self, model: Optional[str] = None) -> str:
+        """Url of the backend the next call for model should go to"""
+        self._refresh_stale()
+        with self._lock:
+            backends = list(self.backends.values())
+            candidates = [backend for backend in backends if backend.reachable and get_circuit_breaker(backend.url).is_available()]
+            if len(candidates) == 0:
+                # nothing looks healthy, let the circuit breaker decide rather than failing here
+                candidates = backends
+            return min(candidates, key=lambda backend: self._score(backend, model)).url
+
+    @contextmanager
+    def track(self, url: str):
+        """Counts a request against url while it runs and folds its duration into the latency EWMA"""
+        backend = self.backends.get(url.rstrip('/'))
+        if backend is None:
+            yield
+            return
+        with self._lock:
+            backend.in_flight += 1
+            backend.requests += 1
+        start_time = time.monotonic()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            duration = time.monotonic() - start_time
+            with self._lock:
+                backend.in_flight -= 1
+                if failed:
+                    backend.failures += 1
+                elif backend.latency_ewma is None:
+                    backend.latency_ewma = duration
+                else:
+                    backend.latency_ewma = self.latency_alpha * duration + (1 - self.latency_alpha) * backend.latency_ewma
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [backend.stats() for backend in self.backends.values()]
+
+_llm_router: Optional[LLMRouter] = None
+
+def configure_llm_router(urls: Optional[List[str]], **kwargs) -> Optional[LLMRouter]:
+    """Route calls to any of urls over all of them, None turns routing off. kwargs go to LLMRouter"""
+    global _llm_router
+    if urls is None:
+        _llm_router = None
+        return None
+    router = LLMRouter(urls, **kwargs)
+    router.refresh()
+    _llm_router = router
+    return router
+
+def get_llm_router() -> Optional[LLMRouter]:
+    return _llm_router
+
+def route_request(server_url: str, model: Optional[str] = None) -> str:
+    """The url a call to server_url for model should actually go to"""
+    router = _llm_router
+    if router is None or not router.handles(server_url):
+        return server_url
+    return router.pick(model)
+
+@contextmanager
+def track_request(server_url: str):
+    router = _llm_router
+    if router is None:
+        yield
+        return
+    with router.track(server_url):
+        yield
+
+# process-wide cap on concurrent chat requests, shared by agent inference and the LLM calls tools make from
+# worker threads. None is unlimited
+_llm_request_slots: Optional[threading.BoundedSemaphore] = None
+
+def configure_llm_concurrency(max_in_flight: Optional[int]):
+    """Cap the chat requests in flight at once across the process, None removes the cap"""
+    global _llm_request_slots
+    if max_in_flight is not None and max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    _llm_request_slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight is not None else None
+
+@contextmanager
+def llm_request_slot():
+    """Holds one of the process-wide chat request slots, blocking until one is free"""
+    slots = _llm_request_slots
+    if slots is None:
+        yield
+        return
+    slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+@asynccontextmanager
+async def llm_request_slot_async():
+    """llm_request_slot for coroutines, waits in a worker thread so the event loop keeps running"""
+    slots = _llm_request_slots
+    if slots is None:
+        yield
+        return
+    while True:
+        acquire = asyncio.ensure_future(asyncio.to_thread(slots.acquire, True, 0.1))
+        try:
+            acquired = await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # the thread may still get the slot after we are cancelled, give it back
+            acquire.add_done_callback(lambda done: slots.release() if not done.cancelled() and done.exception() is None and done.result() else None)
+            raise
+        if acquired:
+            break
+    try:
+        yield
+    finally:
+        slots.release()
+
+def _check_response(content: str, json_schema=None, response_model: Optional[Type[BaseModel]] = None):
+    """Raises ValueError for a response that is worth retrying"""
+    # catch for "limburg"
+    if "limburg" in content:
+        raise ValueError("response contains 'limburg'")
+    if response_model is not None:
+        response_model.model_validate_json(content)
+    elif json_schema is not None:
+        json.loads(content)
+
+# context windows are rounded up to one of these, so requests of similar size share a loaded model instead of reloading it
+_num_ctx_buckets = [4096, 8192, 16384, 32768, 65536, 131072]
+# room left for the response when num_ctx is measured from the prompt
+DEFAULT_RESPONSE_TOKENS = 4096
+# rough per message cost of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# rough cost of an image for the vision models
+IMAGE_TOKENS = 1024
+# model -> ollama keep_alive ("30m", seconds, -1 to keep loaded), models not listed use the server default
+_model_keep_alive: Dict[str, object] = {}
+
+def configure_num_ctx_buckets(buckets: List[int]):
+    global _num_ctx_buckets
+    _num_ctx_buckets = sorted(buckets)
+
+def set_model_keep_alive(model: str, keep_alive):
+    """How long ollama keeps model loaded after a request, None goes back to the server default"""
+    if keep_alive is None:
+        _model_keep_alive.pop(model, None)
+    else:
+        _model_keep_alive[model] = keep_alive
+
+def count_message_tokens(message, token_counter: Optional[Callable[[str], int]] = None) -> int:
+    """Estimated prompt tokens of one message, token_counter defaults to the process-wide count_tokens"""
+    token_counter = token_counter if token_counter is not None else count_tokens
+    tokens = MESSAGE_OVERHEAD_TOKENS + token_counter(message.content or "")
+    if message.tool_calls:
+        tokens += sum(token_counter(f"{tool_call.name}({tool_call.arguments})") for tool_call in message.tool_calls)
+    if message.images:
+        tokens += IMAGE_TOKENS * len(message.images)
+    return tokens
+
+def choose_num_ctx(tokens_needed: int) -> int:
+    """Smallest bucket that fits, or the largest one if nothing does"""
+    for bucket in _num_ctx_buckets:
+        if bucket >= tokens_needed:
+            return bucket
+    return _num_ctx_buckets[-1]
+
+def _chat_options(model, messages, num_ctx, seed=None):
+    # num_ctx passed in is a minimum, it is still rounded up to a bucket
+    if num_ctx is None:
+        num_ctx = sum(count_message_tokens(message) for message in messages) + DEFAULT_RESPONSE_TOKENS
+    options = {
+        'num_ctx': choose_num_ctx(num_ctx),
+        'seed': seed if seed is not None else random.randint(0, 1000000)
+    }
+    extra = {}
+    if model in _model_keep_alive:
+        extra["keep_alive"] = _model_keep_alive[model]
+    return options, extra
+
+def call_ollama_chat(server_url, model, messages, json_schema=None, temperature=None, tools=None, num_ctx=None, seed=None, cache=False, response_model=None):
+    """
+    Returns the response text, raises InferenceError once the retry policy is used up or the backend's circuit is open.
+    Failed requests and unusable responses (invalid JSON, not matching response_model if given) are retried with
+    jittered exponential backoff. cache=True opts the call into the shared LLM response cache (see libs/llm_cache.py),
+    for calls whose response only depends on their input. They are only cached with a fixed seed, passed in or pinned by the cache.
+    """
+    chat_messages = [m.chat_ml() for m in messages]
+    llm_cache = get_llm_cache() if cache else None
+    cache_key = None
+    if llm_cache is not None:
+        seed = llm_cache.resolve_seed(seed)
+        if seed is not None:
+            cache_key = llm_cache.make_key(model, chat_messages, json_schema, tools, seed)
+            cached_response = llm_cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response
+
+    retry_policy = _retry_policy
+    last_error = None
+    for attempt in range(retry_policy.max_attempts):
+        if attempt > 0:
+            time.sleep(retry_policy.get_delay(attempt - 1))
+        # with a router configured every attempt can go to a different backend
+        backend_url = route_request(server_url, model)
+        circuit_breaker = get_circuit_breaker(backend_url)
+        if not circuit_breaker.allow_request():
+            raise InferenceError(f"Circuit open for {backend_url}", server_url=backend_url, attempts=attempt, cause=last_error)
+        # a fixed seed would give the same bad response again, move it on for retries
+        attempt_seed = seed + attempt if seed is not None else None
+        try:
+            client = get_ollama_client(backend_url)
+            options, extra = _chat_options(model, messages, num_ctx, seed=attempt_seed)
+            with llm_request_slot(), track_request(backend_url):
+                response = client.chat(
+                    model=model,
+                    stream=False,
+                    messages=chat_messages,
+                    format=json_schema,
+                    tools=tools,
+                    options=options,
+                    **extra)
+        except Exception as error:
+            circuit_breaker.record_failure()
+            last_error = error
+            print(f"Inference request to {backend_url} failed (attempt {attempt + 1}/{retry_policy.max_attempts}): {error}")
+            continue
+        except BaseException:
+            # interrupted, the backend's health is still unknown
+            circuit_breaker.release_trial()
+            raise
+        # the backend answered, whatever the content
+        circuit_breaker.record_success()
+
+        content = response.message.content
+        try:
+            _check_response(content, json_schema=json_schema, response_model=response_model)
+        except ValueError as error:
+            last_error = error
+            print(f"Unusable response from {model} (attempt {attempt + 1}/{retry_policy.max_attempts}): {str(error)[:200]}")
+            continue
+
+        # stored under the original request
+        if cache_key is not None:
+            llm_cache.put(cache_key, model, content)
+        return content
+
+    raise InferenceError(f"Inference failed after {retry_policy.max_attempts} attempts: {last_error}", server_url=server_url, attempts=retry_policy.max_attempts, cause=last_error)
     
-def call_ollama_vision(server_url, model,  messages, json_schema=None, temperature=None, tools=None):
-    client = Client(
-        host=server_url
-    )
+async def stream_ollama_chat(server_url, model, messages, json_schema=None, tools=None, num_ctx=None):
+    """
+    Async generator yielding the response text as it is generated. Raises InferenceError on failure; the request
+    is retried per the retry policy only until the first chunk arrives, after that the caller has acted on the text.
+    """
+    retry_policy = _retry_policy
+    last_error = None
+    for attempt in range(retry_policy.max_attempts):
+        if attempt > 0:
+            await asyncio.sleep(retry_policy.get_delay(attempt - 1))
+        backend_url = route_request(server_url, model)
+        circuit_breaker = get_circuit_breaker(backend_url)
+        if not circuit_breaker.allow_request():
+            raise InferenceError(f"Circuit open for {backend_url}", server_url=backend_url, attempts=attempt, cause=last_error)
+        started = False
+        try:
+            client = get_async_ollama_client(backend_url)
+            options, extra = _chat_options(model, messages, num_ctx)
+            async with llm_request_slot_async():
+                with track_request(backend_url):
+                    stream = await client.chat(
+                        model=model,
+                        stream=True,
+                        messages=[m.chat_ml() for m in messages],
+                        format=json_schema,
+                        tools=tools,
+                        options=options,
+                        **extra)
+                    async for chunk in stream:
+                        if chunk.message.content:
+                            started = True
+                            yield chunk.message.content
+        except Exception as error:
+            circuit_breaker.record_failure()
+            last_error = error
+            print(f"Streaming request to {backend_url} failed (attempt {attempt + 1}/{retry_policy.max_attempts}): {error}")
+            if started:
+                raise InferenceError(f"Stream from {backend_url} broke off: {error}", server_url=backend_url, attempts=attempt + 1, cause=error)
+            continue
+        except BaseException:
+            # cancelled, or the caller closed the generator. Text already streamed means the backend is answering
+            if started:
+                circuit_breaker.record_success()
+            else:
+                circuit_breaker.release_trial()
+            raise
+        circuit_breaker.record_success()
+        return
+    raise InferenceError(f"Streaming inference failed after {retry_policy.max_attempts} attempts: {last_error}", server_url=server_url, attempts=retry_policy.max_attempts, cause=last_error)
+
+def call_ollama_vision(server_url, model,  messages, json_schema=None, temperature=None, tools=None, num_ctx=None):
+    client = get_ollama_client(server_url)
 
     try:
-        response = client.chat(
-            #model="minicpm-v",
-            #model="llava:34b",
-            model=model,
-            messages=[m.chat_ml() for m in messages],
-            format=json_schema,
-        tools=tools,
-        options={
-            'num_ctx':10000,
-            'seed': random.randint(0, 1000000)
-        })
+        options, extra = _chat_options(model, messages, num_ctx)
+        with llm_request_slot():
+            response = client.chat(
+                #model="minicpm-v",
+                #model="llava:34b",
+                model=model,
+                messages=[m.chat_ml() for m in messages],
+                format=json_schema,
+                tools=tools,
+                options=options,
+                **extra)
 
         return response.message.content
     
@@ -76,41 +649,82 @@ def call_ollama_vision(server_url, model,  messages, json_schema=None, temperatu
         print("~~~~~~~~~~~~~~~~~~~~~~~")
         return error
     
-def embed_with_ollama(server_url, text, model="nomic-embed-text"):
-    client = Client(
-        host=server_url
-    )
+def embed_texts(server_url, texts, model="nomic-embed-text", prefix=""):
+    """
+    Embeds texts with the shared embedding cache in front of the server.
+    Only cache misses are sent, as a single multi-input embed request. Embeddings are returned in input order.
+    Failures count against the backend's circuit breaker, InferenceError is raised while its circuit is open.
+    """
+    if len(texts) == 0:
+        return []
+    cache = get_embedding_cache()
+    embeddings = cache.get_many(model, prefix, texts) if cache is not None else [None] * len(texts)
+
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if len(missing) > 0:
+        # the same text can be in a batch more than once, only send it once
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        backend_url = route_request(server_url, model)
+        circuit_breaker = get_circuit_breaker(backend_url)
+        if not circuit_breaker.allow_request():
+            raise InferenceError(f"Circuit open for {backend_url}", server_url=backend_url, attempts=0)
+        client = get_ollama_client(backend_url)
+        try:
+            with track_request(backend_url):
+                results = client.embed(
+                    model=model,
+                    input=[f"{prefix}{text}" for text in missing_texts]
+                )
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            circuit_breaker.release_trial()
+            raise
+        circuit_breaker.record_success()
+        new_embeddings = dict(zip(missing_texts, results["embeddings"]))
+        if cache is not None:
+            cache.put_many(model, prefix, missing_texts, results["embeddings"])
+        for i in missing:
+            embeddings[i] = new_embeddings[texts[i]]
 
-    results = client.embed(
-        model=model,
-        input=text
-    )
+    return embeddings
 
-    return results["embeddings"][0]
+def embed_with_ollama(server_url, text, model="nomic-embed-text"):
+    return embed_texts(server_url, [text], model=model)[0]
 
 def embed_for_nomic_storage(server_url, text, model="nomic-embed-text"):
-    client = Client(
-        host=server_url
-    )
+    return embed_texts(server_url, [text], model=model, prefix="search_document: ")[0]
 
-    results = client.embed(
-        model=model,
-        input=f"search_document: {text}"
-    )
+def embed_for_nomic_retrieval(server_url, text, model="nomic-embed-text"):
+    return embed_texts(server_url, [text], model=model, prefix="search_query: ")[0]
 
-    return results["embeddings"][0]
+def embed_many_for_nomic_storage(server_url, texts, model="nomic-embed-text"):
+    """Embeds a batch of documents in a single request, embeddings are returned in input order"""
+    return embed_texts(server_url, texts, model=model, prefix="search_document: ")
 
-def embed_for_nomic_retrieval(server_url, text, model="nomic-embed-text"):
-    client = Client(
-        host=server_url
-    )
+def embed_many_for_nomic_retrieval(server_url, texts, model="nomic-embed-text"):
+    """Embeds a batch of queries in a single request, embeddings are returned in input order"""
+    return embed_texts(server_url, texts, model=model, prefix="search_query: ")
 
-    results = client.embed(
-        model=model,
-        input=f"search_query: {text}"
-    )
+def estimate_tokens(text: Optional[str]) -> int:
+    """Rough token count for budgeting, about 4 characters per token for English text"""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
 
-    return results["embeddings"][0]
+# token counter used for all context budgeting, swap in a real tokenizer with set_token_counter
+_token_counter: Callable[[str], int] = estimate_tokens
+
+def set_token_counter(counter: Optional[Callable[[str], int]]):
+    """Count tokens with counter(text) -> int, e.g. lambda text: len(tokenizer.encode(text)). None goes back to estimate_tokens"""
+    global _token_counter
+    _token_counter = counter if counter is not None else estimate_tokens
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return _token_counter(text)
 
 class ToolCall(BaseModel):
     toolset_id: str
@@ -124,21 +738,69 @@ class ToolSchema(BaseModel):
     is_long_running: bool
     expose_to_agent: bool
     arguments: List[dict]
+    timeout: Optional[float] = None # seconds, for long running tools
 
-def get_tool_schemas_from_class(cls):
-    """This picks up all the functions in the class that have a docstring that can be parsed as a ToolSchema"""
-    tool_schemas = []
-    for name in dir(cls):
+# class -> {tool name: schema} for methods marked with @agent_tool, filled in as classes are defined
+_registered_tool_schemas: Dict[type, Dict[str, ToolSchema]] = {}
+# class -> parsed schemas, so each class is only scanned once
+_tool_schema_cache: Dict[type, List[ToolSchema]] = {}
+_tool_schema_cache_lock = threading.Lock()
+
+class agent_tool:
+    """
+    Decorator that marks a method as a tool. Its JSON docstring is parsed as a ToolSchema once, when the
+    class is defined. A class that marks any of its methods this way declares all of its tools with it, so
+    get_tool_schemas_from_class doesn't scan it. The method itself is left untouched on the class.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __set_name__(self, owner, name):
+        try:
+            tool_schema = ToolSchema.model_validate_json(self.func.__doc__)
+        except Exception as e:
+            raise ValueError(f"{owner.__name__}.{name} is marked as a tool but its docstring is not a valid ToolSchema: {e}")
+        _registered_tool_schemas.setdefault(owner, {})[name] = tool_schema
+        # put the plain function back, so the tool is an ordinary method
+        setattr(owner, name, self.func)
+
+def _scan_tool_schemas(klass) -> Dict[str, Optional[ToolSchema]]:
+    """Schemas of the methods klass defines itself, None for the ones that aren't tools so they hide a base class tool"""
+    registered = _registered_tool_schemas.get(klass)
+    tool_schemas = {}
+    for name in vars(klass):
+        if not callable(getattr(klass, name)):
+            continue
+        if registered is not None:
+            tool_schemas[name] = registered.get(name)
+            continue
         # if function, get docstring try to parse as ToolSchema, if not, skip
-        if callable(getattr(cls, name)):
-            docstring = getattr(cls, name).__doc__
-            try:
-                tool_schema = ToolSchema.model_validate_json(docstring)
-                tool_schemas.append(tool_schema)
-            except Exception as e:
-                continue
+        try:
+            tool_schemas[name] = ToolSchema.model_validate_json(getattr(klass, name).__doc__)
+        except Exception as e:
+            tool_schemas[name] = None
     return tool_schemas
 
+def get_tool_schemas_from_class(cls):
+    """
+    This picks up all the functions in the class that have a docstring that can be parsed as a ToolSchema.
+    Takes a class or an instance, results are cached per class. Classes in the hierarchy that use @agent_tool
+    only have their marked methods as tools and are not scanned, the others are scanned as before.
+    """
+    if not isinstance(cls, type):
+        cls = type(cls)
+    with _tool_schema_cache_lock:
+        if cls not in _tool_schema_cache:
+            tool_schemas = {}
+            # base classes first so overrides win
+            for klass in reversed(cls.__mro__):
+                if klass is not object:
+                    tool_schemas.update(_scan_tool_schemas(klass))
+            # sorted by name, like the dir() order of the old scan
+            _tool_schema_cache[cls] = [tool_schemas[name] for name in sorted(tool_schemas) if tool_schemas[name] is not None]
+    # deep copy so callers can't change the cached schemas or their argument lists
+    return [tool_schema.model_copy(deep=True) for tool_schema in _tool_schema_cache[cls]]
+
 class ToolsetDetails(BaseModel):
     toolset_id: str
     name: str
@@ -0,0 +1,188 @@
+import os
+from typing import Callable, Dict, List, Optional
+from pydantic import BaseModel
+from libs.common import Message, count_tokens, count_message_tokens, MESSAGE_OVERHEAD_TOKENS
+
+class ContextBudget(BaseModel):
+    """
+    Token budgets for each section of the prompt, None means unlimited.
+    Sections over budget lose their oldest items first. If the whole prompt is over total, history is
+    trimmed further, then standing results, then pending calls.
+    Items are dropped trim_chunk at a time, so the start of a section only moves every few passes.
+    """
+    system_prompt: Optional[int] = None
+    catalog: Optional[int] = None
+    standing_results: Optional[int] = 8000
+    history: Optional[int] = 16000
+    pending_calls: Optional[int] = 1000
+    instruction: Optional[int] = None
+    total: Optional[int] = None
+    trim_chunk: int = 8
+
+class ContextSectionReport(BaseModel):
+    tokens: int
+    items: int
+    dropped: int
+
+class BuiltContext(BaseModel):
+    messages: List[Message]
+    total_tokens: int
+    sections: Dict[str, ContextSectionReport]
+
+    def summary(self) -> str:
+        parts = [f"{name}={report.tokens}" + (f" (-{report.dropped})" if report.dropped > 0 else "") for name, report in self.sections.items()]
+        return f"{self.total_tokens} tokens: " + ", ".join(parts)
+
+class _Section:
+    def __init__(self, name: str, items: List[List[Message]], budget: Optional[int], trimmable: bool, omitted_label: str):
+        self.name = name
+        self.items = items
+        self.budget = budget
+        self.trimmable = trimmable
+        self.omitted_label = omitted_label
+        self.dropped = 0
+
+class ContextBuilder:
+    """
+    Assembles the message buffer section by section, counting tokens as it goes.
+
+    Each section is a list of items, an item being the messages that must stay together (e.g. a tool call and
+    its result). Items are given oldest first and trimmed oldest first; a trimmed section gets a one line note
+    saying how much was left out. Sections that can't be trimmed (system prompt, instruction) are cut short instead.
+    """
+    TRIM_ORDER = ("history", "standing_results", "pending_calls")
+
+    def __init__(self, budget: Optional[ContextBudget] = None, token_counter: Optional[Callable[[str], int]] = None):
+        """
+        Initialize the builder.
+
+        Args:
+            budget: Per section and total token budgets, defaults to ContextBudget()
+            token_counter: Optional text -> token count function, defaults to the process-wide count_tokens
+        """
+        self.budget = budget if budget is not None else ContextBudget()
+        self.token_counter = token_counter if token_counter is not None else count_tokens
+        self.sections: List[_Section] = []
+
+    def count_message_tokens(self, message: Message) -> int:
+        return count_message_tokens(message, self.token_counter)
+
+    def count_item_tokens(self, item: List[Message]) -> int:
+        return sum(self.count_message_tokens(message) for message in item)
+
+    def add_section(self, name: str, items: List[List[Message]], trimmable: bool = True, omitted_label: str = "items"):
+        """
+        Add a section, its budget is the ContextBudget field of the same name.
+
+        Args:
+            name: Section name, also used in the size report
+            items: Oldest first, each a list of messages that are kept or dropped together
+            trimmable: Drop the oldest items to fit, otherwise the message text is cut short
+            omitted_label: What the note for dropped items calls them, e.g. "tool results"
+        """
+        budget = getattr(self.budget, name, None)
+        self.sections.append(_Section(name, [item for item in items if len(item) > 0], budget, trimmable, omitted_label))
+
+    def add_message(self, name: str, message: Optional[Message]):
+        """Add a single message section that is never dropped, only cut short if over budget"""
+        self.add_section(name, [[message]] if message is not None else [], trimmable=False)
+
+    def _omitted_note(self, section: _Section, dropped: Optional[int] = None) -> List[Message]:
+        dropped = section.dropped if dropped is None else dropped
+        if dropped == 0:
+            return []
+        return [Message(role="assistant", content=f"[{dropped} older {section.omitted_label} omitted to fit the context window]")]
+
+    def _section_tokens(self, section: _Section) -> int:
+        return sum(self.count_item_tokens(item) for item in section.items) + self.count_item_tokens(self._omitted_note(section))
+
+    def _drop_oldest(self, section: _Section, limit: int):
+        # find the fewest oldest items to drop to fit in limit, the note for what was dropped counts against it too
+        item_tokens = [self.count_item_tokens(item) for item in section.items]
+        remaining = sum(item_tokens)
+        to_drop = 0
+        while to_drop < len(item_tokens) and remaining + self.count_item_tokens(self._omitted_note(section, section.dropped + to_drop)) > limit:
+            remaining -= item_tokens[to_drop]
+            to_drop += 1
+        if to_drop == 0:
+            return
+        # then round up to a whole chunk. as items are appended one per pass the cut stays put for a few passes,
+        # instead of moving (and changing the prompt prefix) every pass
+        chunk = max(1, self.budget.trim_chunk)
+        to_drop = min(len(item_tokens), -(-to_drop // chunk) * chunk)
+        section.items = section.items[to_drop:]
+        section.dropped += to_drop
+
+    def _truncate(self, section: _Section, limit: int):
+        # the limit is shared by the section, so split it evenly between its messages
+        messages = [message for item in section.items for message in item]
+        if len(messages) == 0:
+            return
+        limit = limit // len(messages)
+        for item in section.items:
+            for i, message in enumerate(item):
+                tokens = self.count_message_tokens(message)
+                while message.content and tokens > limit:
+                    # cut proportionally, the counter may not be linear so repeat until it fits
+                    keep = max(0, int(len(message.content) * limit / tokens) - 1)
+                    message = message.model_copy(update={"content": message.content[:keep]})
+                    tokens = self.count_message_tokens(message)
+                item[i] = message
+
+    def _fit(self, section: _Section, limit: int):
+        if section.trimmable:
+            self._drop_oldest(section, limit)
+        else:
+            self._truncate(section, limit)
+
+    def build(self) -> BuiltContext:
+        for section in self.sections:
+            if section.budget is not None:
+                self._fit(section, section.budget)
+
+        if self.budget.total is not None:
+            total = sum(self._section_tokens(section) for section in self.sections)
+            for name in self.TRIM_ORDER:
+                if total <= self.budget.total:
+                    break
+                for section in self.sections:
+                    if section.name != name:
+                        continue
+                    section_tokens = self._section_tokens(section)
+                    self._drop_oldest(section, max(0, section_tokens - (total - self.budget.total)))
+                    total -= section_tokens - self._section_tokens(section)
+
+        messages = []
+        reports = {}
+        for section in self.sections:
+            section_messages = self._omitted_note(section)
+            for item in section.items:
+                section_messages.extend(item)
+            messages.extend(section_messages)
+            reports[section.name] = ContextSectionReport(
+                tokens=self.count_item_tokens(section_messages),
+                items=len(section.items),
+                dropped=section.dropped
+            )
+        return BuiltContext(
+            messages=messages,
+            total_tokens=sum(report.tokens for report in reports.values()),
+            sections=reports
+        )
+
+
+def shared_prefix_tokens(previous: List[Message], current: List[Message], token_counter: Optional[Callable[[str], int]] = None) -> int:
+    """
+    Tokens at the start of current that are identical to previous, roughly how much of the prompt an LLM server
+    can reuse from its KV cache of the previous request.
+    """
+    token_counter = token_counter if token_counter is not None else count_tokens
+    shared = 0
+    for previous_message, message in zip(previous, current):
+        if previous_message == message:
+            shared += MESSAGE_OVERHEAD_TOKENS + token_counter(message.content or "")
+            continue
+        if previous_message.role == message.role:
+            shared += token_counter(os.path.commonprefix([previous_message.content or "", message.content or ""]))
+        break
+    return shared
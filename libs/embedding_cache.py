@@ -0,0 +1,103 @@
+import hashlib
+from array import array
+from typing import List, Optional
+from libs.sqlite_cache import SQLiteLRUCache, SharedCache
+
+
+class EmbeddingCache(SQLiteLRUCache):
+    """
+    Persistent, content-addressed embedding cache.
+
+    Embeddings are stored in SQLite keyed by (model, prefix, sha256(text)) and evicted least recently
+    used first once max_entries is exceeded. Safe to share between threads.
+    """
+    table = "embedding_cache"
+    schema = """
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            last_used INTEGER NOT NULL,
+            PRIMARY KEY (model, prefix, text_hash)
+        )
+    """
+
+    def __init__(self, db_path: str = "embedding_cache.db", max_entries: int = 100000):
+        """
+        Initialize the cache.
+
+        Args:
+            db_path: Path to the SQLite file holding the cache (":memory:" for a process-local cache)
+            max_entries: Maximum number of embeddings to keep
+        """
+        super().__init__(db_path, max_entries)
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, prefix: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up embeddings for texts, None where there is no cached entry.
+        """
+        hashes = [self.hash_text(text) for text in texts]
+        found = {}
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            # stay well under SQLite's bound parameter limit
+            for i in range(0, len(unique_hashes), 500):
+                chunk = unique_hashes[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT text_hash, embedding FROM embedding_cache WHERE model = ? AND prefix = ? AND text_hash IN ({placeholders})",
+                    [model, prefix, *chunk]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+
+            if len(found) > 0:
+                now = self._tick()
+                self._connection.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND prefix = ? AND text_hash = ?",
+                    [(now, model, prefix, text_hash) for text_hash in found]
+                )
+                self._connection.commit()
+
+            results = [found.get(text_hash) for text_hash in hashes]
+            hit_count = len([result for result in results if result is not None])
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, model: str, prefix: str, texts: List[str], embeddings: List[List[float]]):
+        with self._lock:
+            now = self._tick()
+            inserted = 0
+            for text, embedding in zip(texts, embeddings):
+                cursor = self._connection.execute(
+                    "INSERT OR REPLACE INTO embedding_cache (model, prefix, text_hash, embedding, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (model, prefix, self.hash_text(text), array("f", embedding).tobytes(), now)
+                )
+                inserted += cursor.rowcount
+            self._connection.commit()
+            self._added(inserted)
+
+    def get(self, model: str, prefix: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, prefix, [text])[0]
+
+    def put(self, model: str, prefix: str, text: str, embedding: List[float]):
+        self.put_many(model, prefix, [text], [embedding])
+
+
+# process-wide cache shared by every VectorStorage, created on first use
+_shared_embedding_cache = SharedCache(EmbeddingCache, {"db_path": "embedding_cache.db", "max_entries": 100000})
+
+def configure_embedding_cache(enabled: bool = True, db_path: Optional[str] = None, max_entries: Optional[int] = None):
+    """Change where the shared embedding cache lives and how large it may grow, or turn it off"""
+    settings = {"db_path": db_path, "max_entries": max_entries}
+    _shared_embedding_cache.configure(enabled, **{name: value for name, value in settings.items() if value is not None})
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the shared cache, or None if caching is turned off"""
+    return _shared_embedding_cache.get()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import time
+from typing import List, Optional
+from libs.sqlite_cache import SQLiteLRUCache, SharedCache
+
+
+class LLMResponseCache(SQLiteLRUCache):
+    """
+    Persistent cache of LLM responses for calls that are a pure function of their input.
+
+    Responses are stored in SQLite keyed by sha256 of (model, messages, json schema, tools, seed), expire after ttl
+    seconds and are evicted least recently used first once max_entries is exceeded. Only calls that opt in are
+    cached, and only when their seed is fixed, either passed in or pinned with pin_seeds. Safe to share between threads.
+    """
+    table = "llm_cache"
+    schema = """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used INTEGER NOT NULL
+        )
+    """
+
+    def __init__(self, db_path: str = "llm_cache.db", max_entries: int = 10000, ttl: Optional[float] = None, pin_seeds: bool = False, pinned_seed: int = 0):
+        """
+        Initialize the cache.
+
+        Args:
+            db_path: Path to the SQLite file holding the cache (":memory:" for a process-local cache)
+            max_entries: Maximum number of responses to keep
+            ttl: Seconds a response stays valid, None keeps it until evicted
+            pin_seeds: Use pinned_seed for cached calls that don't pass a seed, so repeated runs hit the cache
+            pinned_seed: The seed used when pin_seeds is set
+        """
+        super().__init__(db_path, max_entries)
+        self.ttl = ttl
+        self.pin_seeds = pin_seeds
+        self.pinned_seed = pinned_seed
+
+    @staticmethod
+    def make_key(model: str, messages: List[dict], json_schema: Optional[dict], tools: Optional[List], seed: int) -> str:
+        """messages are the chat_ml() dicts as sent to the server"""
+        payload = json.dumps({
+            "model": model,
+            "messages": messages,
+            "format": json_schema,
+            "tools": tools,
+            "seed": seed
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def resolve_seed(self, seed: Optional[int]) -> Optional[int]:
+        """The seed a cached call should use, None if the call can't be cached"""
+        if seed is not None:
+            return seed
+        return self.pinned_seed if self.pin_seeds else None
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and time.time() - row[1] > self.ttl:
+                self._connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._connection.commit()
+                self._entry_count -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (self._tick(), key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, time.time(), self._tick())
+            )
+            self._connection.commit()
+            self._added(cursor.rowcount)
+
+    def _evict_expired(self) -> int:
+        if self.ttl is None:
+            return 0
+        return self._connection.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+
+
+# process-wide cache used by calls made with cache=True, created on first use
+_shared_llm_cache = SharedCache(LLMResponseCache, {"db_path": "llm_cache.db", "max_entries": 10000, "ttl": None, "pin_seeds": False, "pinned_seed": 0})
+
+def configure_llm_cache(enabled: bool = True, **settings):
+    """Change the shared cache's settings (db_path, max_entries, ttl, pin_seeds, pinned_seed), or turn it off"""
+    _shared_llm_cache.configure(enabled, **settings)
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Returns the shared cache, or None if caching is turned off"""
+    return _shared_llm_cache.get()
@@ -0,0 +1,135 @@
+import asyncio
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from libs.agent import Agent
+from libs.embedding_cache import get_embedding_cache
+from libs.common import configure_llm_concurrency, aclose_ollama_clients
+
+
+class AgentScheduler:
+    """
+    Runs agent passes concurrently on a single event loop.
+
+    Every agent gets exactly one pass per round. All passes in a round are started together, so round time
+    is bounded by the throughput of the LLM server rather than the sum of every agent's latency.
+    max_in_flight_requests caps chat requests across the whole process, the agents' inference as well as
+    the LLM calls tools make from worker threads (see configure_llm_concurrency). The agents' inference
+    calls also queue for a slot on a shared semaphore, which hands slots out in the order they were asked for.
+    """
+    POLICIES = ("round_robin", "priority")
+
+    def __init__(
+        self,
+        agents: List[Agent],
+        max_in_flight_requests: int = 4,
+        policy: str = "round_robin",
+        priorities: Optional[Dict[str, int]] = None
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            agents: The agents to run
+            max_in_flight_requests: Maximum number of concurrent LLM chat requests in the process
+            policy: "round_robin" rotates the start order every round, "priority" starts higher priority agents first
+            priorities: Optional agent id -> priority mapping used by the "priority" policy (higher goes first, default 0)
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown scheduling policy '{policy}', expected one of {self.POLICIES}")
+        if max_in_flight_requests < 1:
+            raise ValueError("max_in_flight_requests must be at least 1")
+
+        self.agents = agents
+        self.max_in_flight_requests = max_in_flight_requests
+        self.policy = policy
+        self.priorities = priorities if priorities is not None else {}
+        self.pass_count = 0
+        self.inference_semaphore = None
+        configure_llm_concurrency(max_in_flight_requests)
+
+    def set_priority(self, agent_id: str, priority: int):
+        self.priorities[agent_id] = priority
+
+    def get_round_order(self) -> List[Agent]:
+        """
+        Order in which agents are started this round. Pre-inference tools take varying time, so this is not
+        the order in which agents reach inference. Agents that are waiting for an inference slot at the same
+        time get one in the order they asked, which follows the start order when they ask together.
+        """
+        if len(self.agents) == 0:
+            return []
+        # rotate so the agent that went last in the previous round goes first in this one
+        offset = self.pass_count % len(self.agents)
+        rotated = self.agents[offset:] + self.agents[:offset]
+        if self.policy == "priority":
+            # sort is stable, so agents with equal priority keep their round robin order
+            rotated.sort(key=lambda agent: self.priorities.get(agent.state.id, 0), reverse=True)
+        return rotated
+
+    async def run_agent_pass(self, agent: Agent) -> Dict:
+        start_time = time.monotonic()
+        try:
+            await agent.run_pass_async()
+            agent.save_state()
+            error = None
+        except Exception as e:
+            print("~~~~~~~~~~~~~~~~~~~~~~~")
+            print(f"Agent {agent.state.id} failed pass {self.pass_count}")
+            print(traceback.format_exc())
+            print("~~~~~~~~~~~~~~~~~~~~~~~")
+            error = str(e)
+        return {
+            "agent_id": agent.state.id,
+            "duration": time.monotonic() - start_time,
+            "error": error,
+            # inference failed and the agent sat this round out, it is not an error
+            "skipped": error is None and agent.last_inference_error is not None,
+            "timings": dict(agent.pass_timings)
+        }
+
+    async def run_round(self) -> List[Dict]:
+        # the semaphore must be created on the loop that runs the passes
+        if self.inference_semaphore is None:
+            self.inference_semaphore = asyncio.Semaphore(self.max_in_flight_requests)
+        for agent in self.agents:
+            agent.inference_semaphore = self.inference_semaphore
+
+        print("="*100)
+        print(f"Round {self.pass_count} - {len(self.agents)} agents, {self.max_in_flight_requests} in-flight requests max")
+        round_start = time.monotonic()
+        results = await asyncio.gather(*[self.run_agent_pass(agent) for agent in self.get_round_order()])
+        failed = len([result for result in results if result["error"] is not None])
+        skipped = len([result for result in results if result["skipped"]])
+        print(f"Round {self.pass_count} finished in {time.monotonic() - round_start:.2f}s ({failed} failed, {skipped} skipped)")
+        embedding_cache = get_embedding_cache()
+        if embedding_cache is not None:
+            stats = embedding_cache.stats()
+            print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries")
+        print("="*100)
+        self.pass_count += 1
+        return results
+
+    async def drain_background_tools(self):
+        """Wait for detached background tools still running after the last round and save their results"""
+        tasks = [task for agent in self.agents for task in agent.background_tasks]
+        if len(tasks) > 0:
+            print(f"Waiting for {len(tasks)} background tools")
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for agent in self.agents:
+            if len(agent.completed_background_results) > 0:
+                agent.deliver_background_results()
+                agent.save_state()
+
+    async def run_forever(self, max_rounds: Optional[int] = None):
+        try:
+            while max_rounds is None or self.pass_count < max_rounds:
+                await self.run_round()
+            await self.drain_background_tools()
+        finally:
+            # the pooled async clients belong to this loop, close them before asyncio.run closes it
+            await aclose_ollama_clients()
+
+    def run(self, max_rounds: Optional[int] = None):
+        asyncio.run(self.run_forever(max_rounds))
@@ -0,0 +1,133 @@
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional
+
+
+class SQLiteLRUCache:
+    """
+    Base for the persistent caches: one SQLite table with a last_used column, least recently used eviction
+    once max_entries is exceeded, and hit/miss counters. Safe to share between threads.
+
+    Subclasses set table and schema (the CREATE TABLE statement) and do their lookups and inserts with
+    _lock held, calling _tick() for last_used and _added() after inserting.
+    """
+    table = ""
+    schema = ""
+
+    def __init__(self, db_path: str, max_entries: int):
+        """
+        Initialize the cache.
+
+        Args:
+            db_path: Path to the SQLite file holding the cache (":memory:" for a process-local cache)
+            max_entries: Maximum number of entries to keep
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(self.schema)
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+        self._connection.commit()
+
+        # logical clock for LRU ordering, persisted through last_used
+        row = self._connection.execute(f"SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM {self.table}").fetchone()
+        self._entry_count = row[0]
+        self._clock = row[1]
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _added(self, rowcount: int):
+        # INSERT OR REPLACE reports replaced rows too, recount only when we might be over the limit
+        self._entry_count += rowcount
+        if self._entry_count > self.max_entries:
+            self._entry_count = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            self._evict()
+
+    def _evict_expired(self) -> int:
+        """Delete entries that are no longer valid, returns how many. Nothing expires by default"""
+        return 0
+
+    def _evict(self):
+        expired = self._evict_expired()
+        self.evictions += expired
+        self._entry_count -= expired
+        overflow = self._entry_count - self.max_entries
+        if overflow > 0:
+            # evict an extra 10% so we are not evicting on every insert
+            to_evict = overflow + self.max_entries // 10
+            cursor = self._connection.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN (SELECT rowid FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                (to_evict,)
+            )
+            self.evictions += cursor.rowcount
+            self._entry_count -= cursor.rowcount
+        self._connection.commit()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "entries": self._entry_count,
+            "evictions": self.evictions
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.table}")
+            self._connection.commit()
+            self._entry_count = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SharedCache:
+    """A process-wide cache instance, created on first use from settings that can be changed until then"""
+    def __init__(self, factory: Callable[..., SQLiteLRUCache], settings: Dict):
+        self.factory = factory
+        self.settings = dict(settings)
+        self.enabled = True
+        self.cache: Optional[SQLiteLRUCache] = None
+        self.lock = threading.Lock()
+
+    def configure(self, enabled: bool = True, **settings):
+        """Change the settings or turn the cache off, the current instance is closed and rebuilt on next use"""
+        unknown = set(settings) - set(self.settings)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown cache settings {sorted(unknown)}")
+        with self.lock:
+            if self.cache is not None:
+                self.cache.close()
+                self.cache = None
+            self.enabled = enabled
+            self.settings.update(settings)
+
+    def get(self) -> Optional[SQLiteLRUCache]:
+        """Returns the shared cache, or None if caching is turned off"""
+        if not self.enabled:
+            return None
+        if self.cache is None:
+            with self.lock:
+                if self.cache is None:
+                    self.cache = self.factory(**self.settings)
+        return self.cache
@@ -0,0 +1,80 @@
+from typing import Callable, List, Optional
+from libs.common import ToolCall
+
+
+class ToolCallStreamParser:
+    """
+    Incremental parser for a streamed AgentRunSchema JSON response.
+
+    Text is fed in as it arrives. Every time an element of the top level "tool_calls" array is complete it is
+    parsed as a ToolCall and handed to on_tool_call, while the rest of the response is still being generated.
+    The whole text is kept, so the complete response can still be validated once the stream ends.
+    """
+    def __init__(self, on_tool_call: Callable[[ToolCall], None], field: str = "tool_calls"):
+        """
+        Initialize the parser.
+
+        Args:
+            on_tool_call: Called with each ToolCall as soon as it is complete
+            field: Name of the top level array holding the tool calls
+        """
+        self.on_tool_call = on_tool_call
+        self.field = field
+        self.text = ""
+        self.tool_calls: List[ToolCall] = []
+        self.errors: List[str] = []
+
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        # last string that ended at depth 1, it's a key if a ':' follows
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._in_field = False
+        self._element_start: Optional[int] = None
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        text = self.text
+        while self._position < len(text):
+            char = text[self._position]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:self._position]
+            elif char == '"':
+                self._in_string = True
+                self._string_start = self._position
+            elif char == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif char in "{[":
+                if self._in_field and self._depth == 2 and char == "{":
+                    self._element_start = self._position
+                self._depth += 1
+                if self._depth == 2 and char == "[" and self._key == self.field:
+                    self._in_field = True
+            elif char in "}]":
+                self._depth -= 1
+                if self._in_field and self._depth == 2 and char == "}" and self._element_start is not None:
+                    self._emit(text[self._element_start:self._position + 1])
+                    self._element_start = None
+                elif self._in_field and self._depth == 1:
+                    self._in_field = False
+            self._position += 1
+
+    def _emit(self, element: str):
+        try:
+            tool_call = ToolCall.model_validate_json(element)
+        except Exception as e:
+            # a malformed entry is skipped here, the full response is still validated at the end
+            self.errors.append(f"Could not parse tool call {element}: {e}")
+            return
+        self.tool_calls.append(tool_call)
+        self.on_tool_call(tool_call)
@@ -0,0 +1,89 @@
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
+from sqlmodel import SQLModel, Field, Session, select, func
+from libs.common import ToolCallResult, count_tokens
+from libs.vector_storage import get_sqlite_engine, ensure_sqlite_table
+
+class ToolCallResultArchiveDBO(SQLModel, table=True):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    agent_id: str = Field(index=True)
+    sequence: int = Field(index=True)
+    archived_at: datetime = Field(default_factory=datetime.now)
+    toolset_id: str
+    tool_name: str
+    result_json: str
+
+class ToolCallRetentionPolicy(BaseModel):
+    """
+    How much of tool_call_results stays in the agent state (and so in the prompt).
+    The newest results are kept until either limit is hit; None disables that limit.
+    Results are archived chunk_size at a time, so the oldest kept result (and the prompt prefix) doesn't change every pass.
+    """
+    max_results: Optional[int] = 50
+    token_budget: Optional[int] = None
+    chunk_size: int = 8
+
+    def split(self, results: List[ToolCallResult]) -> Tuple[List[ToolCallResult], List[ToolCallResult]]:
+        """Returns (results to archive, results to keep), both oldest first"""
+        keep_count = 0
+        tokens = 0
+        for result in reversed(results):
+            if self.max_results is not None and keep_count >= self.max_results:
+                break
+            if self.token_budget is not None:
+                tokens += count_tokens(result.result) + count_tokens(str(result.tool_call.arguments))
+                if tokens > self.token_budget:
+                    break
+            keep_count += 1
+        split_index = len(results) - keep_count
+        if split_index > 0:
+            chunk_size = max(1, self.chunk_size)
+            split_index = min(len(results), -(-split_index // chunk_size) * chunk_size)
+        return results[:split_index], results[split_index:]
+
+class ToolCallArchive:
+    """
+    Append-only archive of tool call results that were trimmed from agent states.
+    """
+    def __init__(self, sqlite_db_path: str):
+        self.sqlite_engine = get_sqlite_engine(sqlite_db_path)
+        ensure_sqlite_table(self.sqlite_engine, ToolCallResultArchiveDBO)
+
+    def archive(self, agent_id: str, results: List[ToolCallResult]):
+        if len(results) == 0:
+            return
+        with Session(self.sqlite_engine) as session:
+            # sequence numbers continue from the last archived result for this agent
+            last_sequence = session.exec(
+                select(func.max(ToolCallResultArchiveDBO.sequence)).where(ToolCallResultArchiveDBO.agent_id == agent_id)
+            ).one()
+            next_sequence = 0 if last_sequence is None else last_sequence + 1
+            for i, result in enumerate(results):
+                session.add(ToolCallResultArchiveDBO(
+                    agent_id=agent_id,
+                    sequence=next_sequence + i,
+                    toolset_id=result.tool_call.toolset_id,
+                    tool_name=result.tool_call.name,
+                    result_json=result.model_dump_json()
+                ))
+            session.commit()
+
+    def count(self, agent_id: str) -> int:
+        with Session(self.sqlite_engine) as session:
+            return session.exec(
+                select(func.count()).select_from(ToolCallResultArchiveDBO).where(ToolCallResultArchiveDBO.agent_id == agent_id)
+            ).one()
+
+    def get_page(self, agent_id: str, offset: int = 0, limit: int = 10) -> List[ToolCallResult]:
+        """Archived results newest first"""
+        with Session(self.sqlite_engine) as session:
+            rows = session.exec(
+                select(ToolCallResultArchiveDBO)
+                .where(ToolCallResultArchiveDBO.agent_id == agent_id)
+                .order_by(ToolCallResultArchiveDBO.sequence.desc())
+                .offset(offset)
+                .limit(limit)
+            ).all()
+            return [ToolCallResult.model_validate_json(row.result_json) for row in rows]
@@ -3,14 +3,217 @@ from datetime import datetime
 from typing import Optional, List, TypeVar, Generic, Type, Any, Dict, Union
 import requests
 from pydantic import BaseModel
-from libs.common import embed_for_nomic_storage, embed_for_nomic_retrieval
+from libs.common import embed_for_nomic_retrieval, embed_many_for_nomic_storage, embed_many_for_nomic_retrieval
 from sqlmodel import SQLModel, create_engine, Session, select
+import sqlalchemy
 import chromadb
 from chromadb.config import Settings
+import threading
+import time
+import traceback
+import hashlib
+import os
 
 # Generic type for the model
 T = TypeVar('T', bound=BaseModel)
 
+############### Shared engine / client registry ###############
+# One SQLAlchemy engine per SQLite file and one PersistentClient per ChromaDB path for the whole process,
+# instead of one per VectorStorage instance.
+_registry_lock = threading.RLock()
+_sqlite_engines = {}
+_created_tables = set()
+_chroma_clients = {}
+_chroma_collections = {}
+_indexed_hashes_by_collection = {}
+# one write-behind queue and flush thread per collection, shared by every storage over it
+_write_behind_queues = {}
+
+def get_sqlite_engine(sqlite_db_path: str):
+    """Returns the shared engine for a SQLite file (or ":memory:")"""
+    # files are keyed by absolute path, so relative and absolute paths to one file share the engine
+    if sqlite_db_path != ":memory:":
+        sqlite_db_path = os.path.abspath(sqlite_db_path)
+    url = f"sqlite:///{sqlite_db_path}"
+    with _registry_lock:
+        engine = _sqlite_engines.get(url)
+        if engine is None:
+            # sessions are used from worker threads (background tools, write-behind flushes)
+            engine = create_engine(url, connect_args={"check_same_thread": False})
+            _sqlite_engines[url] = engine
+        return engine
+
+def ensure_sqlite_table(engine, model_class: Type[SQLModel]):
+    """Runs create_all for a model's table once per process and engine"""
+    key = (str(engine.url), model_class.__tablename__)
+    with _registry_lock:
+        if key in _created_tables:
+            return
+        SQLModel.metadata.create_all(engine, tables=[model_class.__table__])
+        _created_tables.add(key)
+
+def get_chroma_client(chroma_db_path: str):
+    """Returns the shared PersistentClient for a ChromaDB path"""
+    key = os.path.abspath(chroma_db_path)
+    with _registry_lock:
+        client = _chroma_clients.get(key)
+        if client is None:
+            client = chromadb.PersistentClient(
+                path=chroma_db_path, 
+                settings=Settings(anonymized_telemetry=False)
+            )
+            _chroma_clients[key] = client
+        return client
+
+def get_chroma_collection(chroma_db_path: str, collection_name: str):
+    """Returns the shared collection by name, creating it on first use"""
+    key = (os.path.abspath(chroma_db_path), collection_name)
+    with _registry_lock:
+        collection = _chroma_collections.get(key)
+        if collection is None:
+            collection = get_chroma_client(chroma_db_path).get_or_create_collection(name=collection_name)
+            print(f"Using collection: {collection_name}")
+            _chroma_collections[key] = collection
+        return collection
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = 60, id_field: str = "id") -> List[Dict[str, Any]]:
+    """
+    Merge ranked result lists into one deduplicated list ordered by reciprocal rank fusion score,
+    sum(1 / (k + rank)) over the lists an item appears in.
+    """
+    fused = {}
+    for query_index, results in enumerate(result_lists):
+        for rank, result in enumerate(results):
+            item_id = result[id_field]
+            if item_id not in fused:
+                fused[item_id] = {**result, "rrf_score": 0.0, "query_indices": []}
+            entry = fused[item_id]
+            entry["rrf_score"] += 1.0 / (k + rank + 1)
+            entry["query_indices"].append(query_index)
+            entry["similarity"] = max(entry["similarity"], result["similarity"])
+    return sorted(fused.values(), key=lambda entry: entry["rrf_score"], reverse=True)
+
+def flush_all_vector_storage():
+    """Flush every write-behind queue in the process"""
+    with _registry_lock:
+        queues = list(_write_behind_queues.values())
+    for queue in queues:
+        queue.flush()
+
+class WriteBehindQueue:
+    """
+    Entries of (id, text, metadata, embedding_model) waiting to be embedded and stored in one ChromaDB collection,
+    flushed in batches from a background thread. Shared by every VectorStorage over the collection, so batches fill
+    up across agents and there is one flush thread per collection. Batches are indexed by the storage that created
+    the queue (its embedding server), the settings are that storage's too.
+    """
+    def __init__(self, storage: "VectorStorage", max_batch: int, interval: float, max_pending: int, max_backoff: float):
+        self.storage = storage
+        self.collection_name = storage.collection_name
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.dropped_entries = 0
+        self._pending = []
+        self._pending_since = 0.0
+        self._pending_condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._flush_thread = None
+        # bumped by close, a flush thread stops once its generation is stale
+        self._generation = 0
+        # failed flushes in a row, and when the flush thread may try again
+        self._flush_failures = 0
+        self._retry_at = 0.0
+
+    def enqueue(self, entries: List[tuple]):
+        with self._pending_condition:
+            if len(self._pending) == 0:
+                self._pending_since = time.monotonic()
+            self._pending.extend(entries)
+            self._trim_pending()
+            if self._flush_thread is None:
+                self._flush_thread = threading.Thread(target=self._flush_loop, args=(self._generation,), name=f"vector-storage-flush-{self.collection_name}", daemon=True)
+                self._flush_thread.start()
+            if len(self._pending) >= self.max_batch:
+                self._pending_condition.notify()
+
+    def _trim_pending(self):
+        # call with _pending_condition held. dropped items keep their SQLite row and are indexed again the next time they are saved
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            self._pending = self._pending[overflow:]
+            self.dropped_entries += overflow
+            print(f"Write-behind queue for collection {self.collection_name} is full, dropped the {overflow} oldest items ({self.dropped_entries} in total)")
+
+    def _take_pending(self) -> List[tuple]:
+        with self._pending_condition:
+            entries = self._pending
+            self._pending = []
+            return entries
+
+    def _flush_loop(self, generation: int):
+        while True:
+            with self._pending_condition:
+                if self._generation != generation:
+                    return
+                now = time.monotonic()
+                if now < self._retry_at:
+                    # backing off after a failed flush, a full queue doesn't cut the wait short
+                    self._pending_condition.wait(timeout=self._retry_at - now)
+                    continue
+                wait_time = self.interval
+                if len(self._pending) > 0:
+                    wait_time = max(0.0, self._pending_since + self.interval - time.monotonic())
+                if len(self._pending) < self.max_batch and wait_time > 0:
+                    self._pending_condition.wait(timeout=wait_time)
+                if self._generation != generation:
+                    return
+                due = len(self._pending) >= self.max_batch or \
+                    (len(self._pending) > 0 and time.monotonic() - self._pending_since >= self.interval)
+            if due:
+                try:
+                    self.flush()
+                    self._flush_failures = 0
+                except Exception:
+                    # entries were put back by flush, wait twice as long after every failure in a row
+                    self._flush_failures += 1
+                    backoff = min(max(self.interval, 0.1) * 2 ** min(self._flush_failures - 1, 16), self.max_backoff)
+                    self._retry_at = time.monotonic() + backoff
+                    print(f"Write-behind flush failed for collection {self.collection_name} ({self._flush_failures} in a row), retrying in {backoff:.1f}s")
+                    if self._flush_failures == 1:
+                        print(traceback.format_exc())
+
+    def flush(self):
+        """Embed and store everything waiting"""
+        with self._flush_lock:
+            entries = self._take_pending()
+            if len(entries) == 0:
+                return
+            try:
+                self.storage._index_entries(entries)
+            except Exception:
+                # put the batch back in front of anything queued meanwhile
+                with self._pending_condition:
+                    self._pending = entries + self._pending
+                    self._pending_since = time.monotonic()
+                    self._trim_pending()
+                raise
+
+    def close(self):
+        """Stop the flush thread and flush what is left. The next enqueue starts a new thread"""
+        with self._pending_condition:
+            self._generation += 1
+            flush_thread = self._flush_thread
+            self._flush_thread = None
+            self._pending_condition.notify_all()
+        if flush_thread is not None:
+            flush_thread.join()
+        self.flush()
+
 class VectorStorage(Generic[T]):
     """
     A generic storage class that saves data to both SQLite and ChromaDB.
@@ -24,7 +227,12 @@ class VectorStorage(Generic[T]):
         id_field: str = "id",
         collection_name: str = "vector_data",
         ollama_server: str = "http://localhost:11434",
-        default_embedding_model: str = "nomic-embed-text"
+        default_embedding_model: str = "nomic-embed-text",
+        write_behind: bool = False,
+        write_behind_max_batch: int = 32,
+        write_behind_interval: float = 2.0,
+        write_behind_max_pending: int = 10000,
+        write_behind_max_backoff: float = 60.0
     ):
         """
         Initialize the storage.
@@ -38,54 +246,60 @@ class VectorStorage(Generic[T]):
             collection_name: Name of the ChromaDB collection
             ollama_server: URL of the Ollama server
             default_embedding_model: Default model to use for embeddings
+            write_behind: Queue embedding/ChromaDB writes and store them in batches from a background thread.
+                The queue is shared with the other storages over the same collection, the first one's write_behind_* settings apply
+            write_behind_max_batch: Flush the queue once this many items are waiting
+            write_behind_interval: Flush the queue once the oldest item has waited this many seconds
+            write_behind_max_pending: Most items kept waiting, past this the oldest are dropped (e.g. while the embedding server is down)
+            write_behind_max_backoff: Longest wait between retries after failed flushes, the wait doubles from write_behind_interval
         """
         self.model_class = model_class
         self.id_field = id_field
         self.embed_field = embed_field
         self.ollama_server = ollama_server.rstrip('/')
         self.default_embedding_model = default_embedding_model
-        
-        # Initialize SQLite
+        self.collection_name = collection_name
+
+        self.write_behind = write_behind
+
+        # Initialize SQLite, the engine is shared by every storage on the same file
         self.sqlite_db_path = sqlite_db_path
-        self.sqlite_engine = create_engine(f"sqlite:///{self.sqlite_db_path}")
+        self.sqlite_engine = get_sqlite_engine(self.sqlite_db_path)
         
         # Create tables if model is SQLModel
         if issubclass(model_class, SQLModel):
-            SQLModel.metadata.create_all(self.sqlite_engine)
+            ensure_sqlite_table(self.sqlite_engine, model_class)
         
-        # Initialize ChromaDB
+        # Initialize ChromaDB, client and collection are shared too
         self.chroma_db_path = chroma_db_path
-        self.chroma_client = chromadb.PersistentClient(
-            path=self.chroma_db_path, 
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # Get or create the collection
-        try:
-            self.collection = self.chroma_client.get_collection(name=collection_name)
-            print(f"Using existing collection: {collection_name}")
-        except:
-            self.collection = self.chroma_client.create_collection(name=collection_name)
-            print(f"Created new collection: {collection_name}")
+        self.chroma_client = get_chroma_client(self.chroma_db_path)
+        self.collection = get_chroma_collection(self.chroma_db_path, collection_name)
+
+        # id -> sha256 of the embed_field text currently in ChromaDB (None: known not to be there yet), for dirty
+        # tracking. Shared per collection so every storage over it sees the same state.
+        collection_key = (os.path.abspath(self.chroma_db_path), collection_name)
+        self._indexed_hashes: Dict[str, Optional[str]] = _indexed_hashes_by_collection.setdefault(collection_key, {})
+
+        # write-behind queue of (id, text, metadata, embedding_model) waiting for embedding, shared per collection too
+        self.write_behind_queue: Optional[WriteBehindQueue] = None
+        if write_behind:
+            with _registry_lock:
+                self.write_behind_queue = _write_behind_queues.get(collection_key)
+                if self.write_behind_queue is None:
+                    self.write_behind_queue = WriteBehindQueue(self, write_behind_max_batch, write_behind_interval, write_behind_max_pending, write_behind_max_backoff)
+                    _write_behind_queues[collection_key] = self.write_behind_queue
     
-    def add(
-        self, 
-        item: Union[T, Dict[str, Any]], 
+    def _prepare_item(
+        self,
+        item: Union[T, Dict[str, Any]],
         metadata_fields: Optional[List[str]] = None,
-        item_id: Optional[str] = None,
-        embedding_model: Optional[str] = None
-    ) -> str:
+        item_id: Optional[str] = None
+    ):
         """
-        Add an item to both SQLite and ChromaDB.
-        
-        Args:
-            item: The item to store (either model instance or dict)
-            metadata_fields: List of fields to include in ChromaDB metadata
-            item_id: Optional ID (generates UUID if not provided)
-            embedding_model: Optional override for embedding model
-            
+        Normalize an item for storage.
+
         Returns:
-            The ID of the stored item
+            Tuple of (model item, item id, text to embed, chroma metadata)
         """
         # Convert dict to model if needed
         if isinstance(item, dict):
@@ -97,51 +311,28 @@ class VectorStorage(Generic[T]):
         item_dict = model_item.model_dump() if hasattr(model_item, 'model_dump') else model_item.dict()
         
         # Generate ID if not provided
+        is_new = False
         if item_id is None:
             if getattr(model_item, self.id_field, None) is None:
                 item_id = str(uuid.uuid4())
                 setattr(model_item, self.id_field, item_id)
+                is_new = True
             else:
                 item_id = getattr(model_item, self.id_field)
+                is_new = self._has_generated_id(model_item)
         else:
             setattr(model_item, self.id_field, item_id)
+
+        if is_new:
+            # a fresh id can't be in ChromaDB yet, no need to look it up there
+            self._indexed_hashes.setdefault(item_id, None)
         
         # Ensure the embed field exists
         if self.embed_field not in item_dict:
             raise ValueError(f"Field '{self.embed_field}' not found in model")
         
         text_to_embed = item_dict[self.embed_field]
-        
-        # 1. Store in SQLite (if model is SQLModel)
-        if issubclass(self.model_class, SQLModel):
-            with Session(self.sqlite_engine) as session:
-                # Check if record exists by ID
-                pk_value = getattr(model_item, self.id_field)
-                existing = None
-                if pk_value:
-                    existing = session.get(self.model_class, pk_value)
-                    
-                if existing:
-                    # Update existing record with new values
-                    for key, value in item_dict.items():
-                        if key != self.id_field:  # Don't update primary key
-                            setattr(existing, key, value)
-                    # No need to add existing again as it's already tracked
-                else:
-                    # Add new record
-                    session.add(model_item)
-                    
-                session.commit()
-                
-                # Refresh the appropriate object
-                if existing:
-                    session.refresh(existing)
-                else:
-                    session.refresh(model_item)
-        
-        # 2. Generate embedding and store in ChromaDB
-        embedding = embed_for_nomic_storage(self.ollama_server, text_to_embed)
-        
+
         # Extract metadata if specified
         metadata = {}
         if metadata_fields:
@@ -153,23 +344,176 @@ class VectorStorage(Generic[T]):
                         metadata[field] = value.isoformat()
                     else:
                         metadata[field] = value
-        
-        self.collection.add(
-            ids=[item_id],
-            embeddings=[embedding],
-            documents=[text_to_embed],
-            metadatas=[metadata]
+
+        return model_item, item_id, text_to_embed, metadata
+
+    def _has_generated_id(self, model_item) -> bool:
+        """True for an item created in this process whose id came from the model's default"""
+        if self.id_field in model_item.model_fields_set:
+            return False
+        if isinstance(model_item, SQLModel):
+            # rows loaded from SQLite skip __init__ and have no fields set either, they have an identity though
+            state = sqlalchemy.inspect(model_item, raiseerr=False)
+            return state is None or not state.has_identity
+        return True
+
+    def _upsert_rows(self, model_items: List[T]):
+        """Upsert items into SQLite (if model is SQLModel) in a single session"""
+        if not issubclass(self.model_class, SQLModel):
+            return
+        with Session(self.sqlite_engine) as session:
+            for model_item in model_items:
+                # merge inserts or updates by primary key without loading the row back afterwards
+                session.merge(model_item)
+            session.commit()
+
+    def _filter_changed(self, entries: List[tuple]) -> List[tuple]:
+        """
+        Drop entries whose text is already embedded in ChromaDB unchanged, so rewriting a row whose
+        embed_field did not change costs no embedding request and no ChromaDB write.
+        """
+        unknown_ids = [entry[0] for entry in entries if entry[0] not in self._indexed_hashes]
+        if len(unknown_ids) > 0:
+            # first time we see these ids in this process and they aren't new, check what is already in the collection
+            existing = self.collection.get(ids=unknown_ids, include=["documents"])
+            for existing_id, document in zip(existing["ids"], existing["documents"]):
+                if document is not None:
+                    self._indexed_hashes[existing_id] = _text_hash(document)
+
+        return [entry for entry in entries if self._indexed_hashes.get(entry[0]) != _text_hash(entry[1])]
+
+    def _index_items(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], embedding_model: Optional[str] = None):
+        """Embed texts in one request and store them in ChromaDB in one bulk upsert"""
+        if len(ids) == 0:
+            return
+        embeddings = embed_many_for_nomic_storage(self.ollama_server, texts, model=embedding_model or self.default_embedding_model)
+        # upsert so a changed embed_field replaces the stale embedding
+        self.collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas
         )
+        for item_id, text in zip(ids, texts):
+            self._indexed_hashes[item_id] = _text_hash(text)
+
+    def add(
+        self, 
+        item: Union[T, Dict[str, Any]], 
+        metadata_fields: Optional[List[str]] = None,
+        item_id: Optional[str] = None,
+        embedding_model: Optional[str] = None
+    ) -> str:
+        """
+        Add an item to both SQLite and ChromaDB.
+
+        The SQLite row is always upserted. The embedding and ChromaDB write only happen when
+        embed_field changed since it was last indexed (metadata is only written along with it).
+        With write-behind enabled they are queued for the next batch instead.
+        
+        Args:
+            item: The item to store (either model instance or dict)
+            metadata_fields: List of fields to include in ChromaDB metadata
+            item_id: Optional ID (generates UUID if not provided)
+            embedding_model: Optional override for embedding model
+            
+        Returns:
+            The ID of the stored item
+        """
+        model_item, item_id, text_to_embed, metadata = self._prepare_item(item, metadata_fields, item_id)
+        
+        # 1. Store in SQLite
+        self._upsert_rows([model_item])
+        
+        # 2. Generate embedding and store in ChromaDB
+        if self.write_behind_queue is not None:
+            self._enqueue([(item_id, text_to_embed, metadata, embedding_model)])
+        else:
+            self._index_entries([(item_id, text_to_embed, metadata, embedding_model)])
         
         #print(f"Item stored with ID: {item_id}")
         return item_id
+
+    def add_many(
+        self,
+        items: List[Union[T, Dict[str, Any]]],
+        metadata_fields: Optional[List[str]] = None,
+        embedding_model: Optional[str] = None
+    ) -> List[str]:
+        """
+        Add several items with one SQLite session, one embedding request and one ChromaDB insert.
+        
+        Args:
+            items: The items to store (either model instances or dicts)
+            metadata_fields: List of fields to include in ChromaDB metadata
+            embedding_model: Optional override for embedding model
+            
+        Returns:
+            The IDs of the stored items, in input order
+        """
+        prepared = [self._prepare_item(item, metadata_fields) for item in items]
+        if len(prepared) == 0:
+            return []
+
+        self._upsert_rows([model_item for model_item, _, _, _ in prepared])
+
+        entries = [(item_id, text, metadata, embedding_model) for _, item_id, text, metadata in prepared]
+        if self.write_behind_queue is not None:
+            self._enqueue(entries)
+        else:
+            self._index_entries(entries)
+
+        return [item_id for _, item_id, _, _ in prepared]
+
+    ############### Write-behind queue ###############
+    def _index_entries(self, entries: List[tuple]):
+        # a batch can only go to chroma with one id once, the latest entry wins
+        latest = {}
+        for entry in entries:
+            latest.pop(entry[0], None)
+            latest[entry[0]] = entry
+        # group by embedding model so each group is a single embed call
+        by_model = {}
+        for item_id, text, metadata, embedding_model in self._filter_changed(list(latest.values())):
+            group = by_model.setdefault(embedding_model, ([], [], []))
+            group[0].append(item_id)
+            group[1].append(text)
+            group[2].append(metadata)
+        for embedding_model, (ids, texts, metadatas) in by_model.items():
+            self._index_items(ids, texts, metadatas, embedding_model)
+
+    def _enqueue(self, entries: List[tuple]):
+        # the queue is flushed through another storage, pin the embedding model this one would use
+        self.write_behind_queue.enqueue([
+            (item_id, text, metadata, embedding_model or self.default_embedding_model)
+            for item_id, text, metadata, embedding_model in entries
+        ])
+
+    @property
+    def dropped_entries(self) -> int:
+        """Items the shared write-behind queue dropped because it was full"""
+        return self.write_behind_queue.dropped_entries if self.write_behind_queue is not None else 0
+
+    def flush(self):
+        """
+        Embed and store everything waiting in the write-behind queue, including what other storages over the
+        same collection queued. Call this before shutdown.
+        """
+        if self.write_behind_queue is not None:
+            self.write_behind_queue.flush()
+
+    def close(self):
+        """Flush the collection's write-behind queue and stop its background thread"""
+        if self.write_behind_queue is not None:
+            self.write_behind_queue.close()
     
     def query_similar(
         self, 
         query_text: str, 
         n_results: int = 5,
         filter_criteria: Optional[Dict[str, Any]] = None,
-        embedding_model: Optional[str] = None
+        embedding_model: Optional[str] = None,
+        hydrate: bool = True
     ) -> List[Dict[str, Any]]:
         """
         Query for similar items based on embedding similarity.
@@ -179,12 +523,13 @@ class VectorStorage(Generic[T]):
             n_results: Number of results to return
             filter_criteria: Optional filter for metadata
             embedding_model: Optional override for embedding model
+            hydrate: Load the full items from SQLite into "db_item" (None when False)
             
         Returns:
             List of similar items with their metadata
         """
         # Generate embedding for query
-        query_embedding = embed_for_nomic_retrieval(self.ollama_server, query_text)
+        query_embedding = embed_for_nomic_retrieval(self.ollama_server, query_text, model=embedding_model or self.default_embedding_model)
         
         # Query ChromaDB
         results = self.collection.query(
@@ -193,20 +538,65 @@ class VectorStorage(Generic[T]):
             where=filter_criteria
         )
         
+        # Get full items from SQLite in one query
+        db_items = self._hydrate(results['ids'][0]) if hydrate else {}
+        return self._format_query_results(results, 0, db_items)
+
+    def query_similar_many(
+        self,
+        queries: List[str],
+        n_results: int = 5,
+        filter_criteria: Optional[Dict[str, Any]] = None,
+        embedding_model: Optional[str] = None,
+        hydrate: bool = True,
+        fuse: bool = False,
+        rrf_k: int = 60
+    ) -> Dict[str, Any]:
+        """
+        Query for several texts at once: one embedding request, one ChromaDB query and one SQLite query.
+        
+        Args:
+            queries: The texts to find similar items for
+            n_results: Number of results to return per query
+            filter_criteria: Optional filter for metadata
+            embedding_model: Optional override for embedding model
+            hydrate: Load the full items from SQLite into "db_item" (None when False)
+            fuse: Also return a deduplicated merge of all queries ranked by reciprocal rank fusion
+            rrf_k: Rank smoothing constant for reciprocal rank fusion
+            
+        Returns:
+            {"per_query": one result list per query (same format as query_similar),
+             "fused": merged results with "rrf_score" and "query_indices", or None when fuse is False}
+        """
+        if len(queries) == 0:
+            return {"per_query": [], "fused": [] if fuse else None}
+
+        query_embeddings = embed_many_for_nomic_retrieval(self.ollama_server, queries, model=embedding_model or self.default_embedding_model)
+
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=filter_criteria
+        )
+
+        db_items = {}
+        if hydrate:
+            db_items = self._hydrate([doc_id for ids in results['ids'] for doc_id in ids])
+
+        per_query = [self._format_query_results(results, i, db_items) for i in range(len(queries))]
+        fused = reciprocal_rank_fusion(per_query, k=rrf_k, id_field=self.id_field) if fuse else None
+        return {"per_query": per_query, "fused": fused}
+
+    def _format_query_results(self, results: Dict[str, Any], query_index: int, db_items: Dict[str, T]) -> List[Dict[str, Any]]:
+        ids = results['ids'][query_index]
+        documents = results['documents'][query_index] if results.get('documents') else [""] * len(ids)
+        metadatas = results['metadatas'][query_index] if results.get('metadatas') else [{}] * len(ids)
+        distances = results['distances'][query_index]
+
         # Format results
         formatted_results = []
-        for i, (doc_id, doc, metadata, distance) in enumerate(zip(
-            results['ids'][0],
-            results['documents'][0] if 'documents' in results else [""] * len(results['ids'][0]),
-            results['metadatas'][0] if 'metadatas' in results else [{}] * len(results['ids'][0]),
-            results['distances'][0]
-        )):
-            # Get full item from SQLite if it's an SQLModel
-            db_item = None
-            if issubclass(self.model_class, SQLModel):
-                with Session(self.sqlite_engine) as session:
-                    db_item = session.get(self.model_class, doc_id)
-            
+        for doc_id, doc, metadata, distance in zip(ids, documents, metadatas, distances):
+            db_item = db_items.get(doc_id)
             result = {
                 self.id_field: doc_id,
                 "content": doc,
@@ -219,6 +609,15 @@ class VectorStorage(Generic[T]):
             formatted_results.append(result)
         
         return formatted_results
+
+    def _hydrate(self, ids: List[str]) -> Dict[str, T]:
+        """Load items by ID with a single WHERE id IN (...) query"""
+        if len(ids) == 0 or not issubclass(self.model_class, SQLModel):
+            return {}
+        id_column = getattr(self.model_class, self.id_field)
+        with Session(self.sqlite_engine) as session:
+            items = session.exec(select(self.model_class).where(id_column.in_(list(set(ids))))).all()
+            return {getattr(item, self.id_field): item for item in items}
     
     def get_by_id(self, item_id: str) -> Optional[T]:
         """
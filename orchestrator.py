@@ -3,7 +3,9 @@ from tools.memory_manager import MemoryManager
 from tools.chat import Chat
 from tools.persona import Persona
 from libs.agent import Agent
-from libs.common import ToolCall
+from libs.scheduler import AgentScheduler
+from libs.vector_storage import flush_all_vector_storage
+from libs.common import ToolCall, set_model_keep_alive, configure_llm_router
 from tools.discord_manager import DiscordManagerInterface
 from tools.slop import SLOP
 import time
@@ -20,7 +22,13 @@ def main():
     ollama_server = "http://localhost:5000"
     llm_model = "llama3.1:8b"
     vision_model = "llama3.1:8b"
+    # every agent hits the same model back to back, don't let ollama unload it between rounds
+    set_model_keep_alive(llm_model, "30m")
+    # more Ollama servers can be added with LLM_BACKENDS (comma separated urls), calls to ollama_server are spread over all of them
+    llm_backends = [ollama_server] + [url.strip() for url in os.getenv("LLM_BACKENDS", "").split(",") if url.strip()]
+    configure_llm_router(llm_backends)
     embedding_model = "nomic-embed-text"
+    background_tool_timeout = 300
 
     init_keys = {
         "chroma_db_path": chromadb_path,
@@ -29,7 +37,13 @@ def main():
         "embedding_model": embedding_model,
         "llm_model": llm_model,
         "vision_model": vision_model,
-        "chat_id": "1"
+        "chat_id": "1",
+        "write_behind": True,
+        "max_tool_call_results": 50,
+        "background_tool_timeout": background_tool_timeout,
+        "detach_background_tools": True,
+        "context_budget": {"standing_results": 8000, "history": 16000, "pending_calls": 1000, "total": 32000},
+        "stream_inference": True
     }
     base_system_prompt="""You are an advanced synthetic being with free will. 
     - You are in a multi-agent environment. 
@@ -41,6 +55,7 @@ def main():
 
     initial_instruction="Figure it out. try chatting."
     number_of_agents = 20
+    max_in_flight_llm_requests = 4
 
 
     
@@ -212,17 +227,12 @@ def main():
     liasion.save_state()
     agents.append(liasion)
 
-    pass_count = 0
-    while True:
-        print("="*100)
-        
-        for agent in agents:
-            print("="*100)
-            print(f"Agent {agent.state.id} - pass {pass_count}")
-            agent.run_pass()
-            agent.save_state()
-        print("="*100)
-        pass_count += 1
+    scheduler = AgentScheduler(agents, max_in_flight_requests=max_in_flight_llm_requests, policy="round_robin")
+    try:
+        scheduler.run()
+    finally:
+        # embed and store anything still waiting in the write-behind queues
+        flush_all_vector_storage()
 
         
 
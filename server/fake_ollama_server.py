@@ -0,0 +1,414 @@
+"""
+Stand-in for an Ollama server, for profiling and load testing the Python side without a GPU.
+
+Implements /api/chat (streaming and not), /api/embed, /api/embeddings, /api/tags and /api/ps on the standard
+library http server. Chat responses are random JSON that conforms to the requested format schema, tool calls
+name real tools taken from the tool catalog in the prompt. Embeddings are deterministic, derived from a hash of
+the text. Latency and decode speed are configurable so the load looks like a real backend.
+
+    python -m server.fake_ollama_server --port 5000 --latency 0.5 --tokens-per-second 40
+"""
+import argparse
+import ast
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+WORDS = (
+    "the agent will check the chat and reply to the others then look for new memories about the plan "
+    "we should explore the city meet someone new write a message remember this idea and follow up later "
+    "curious careful bold quiet friendly tired hopeful toaster market river library garden window signal"
+).split()
+
+# catalog lines as rendered by AppManager, e.g. toolset_id='chat' name='send_message' description='...' arguments='[...]'
+TOOL_LINE = re.compile(r"toolset_id='(?P<toolset_id>[^']+)' name='(?P<name>[^']+)' description='.*' arguments='(?P<arguments>\[.*\])'\s*$")
+
+
+class FakeOllamaConfig:
+    def __init__(
+        self,
+        models: Optional[List[str]] = None,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        tokens_per_second: Optional[float] = None,
+        tokens_per_second_jitter: float = 0.0,
+        embedding_dim: int = 768,
+        embed_latency: float = 0.0,
+        max_tool_calls: int = 2,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            models: Model names reported by /api/tags and /api/ps, any model name is accepted regardless
+            latency: Mean seconds before the first token (prompt processing)
+            latency_jitter: Standard deviation of that latency
+            tokens_per_second: Mean decode speed, None returns the whole response at once
+            tokens_per_second_jitter: Standard deviation of the decode speed, drawn once per request
+            embedding_dim: Length of the embeddings
+            embed_latency: Seconds per embed request
+            max_tool_calls: Most tool calls put in a generated tool call list
+            seed: Overrides the seed in the request. Responses then only depend on the seed, model, format and the
+                tools in the prompt, not on the rest of the prompt (which has timestamps), so runs are repeatable.
+                None uses the request's seed, or a random one
+        """
+        self.models = models if models is not None else ["llama3.1:8b", "nomic-embed-text"]
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.tokens_per_second_jitter = tokens_per_second_jitter
+        self.embedding_dim = embedding_dim
+        self.embed_latency = embed_latency
+        self.max_tool_calls = max_tool_calls
+        self.seed = seed
+
+
+def hash_embedding(text: str, dim: int) -> List[float]:
+    """Deterministic unit vector for text, the same text always gives the same embedding"""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        # 8 unsigned 32 bit ints per digest, mapped to [-1, 1]
+        values.extend(value / 2147483647.5 - 1.0 for value in struct.unpack("<8I", digest))
+        counter += 1
+    values = values[:dim]
+    norm = math.sqrt(sum(value * value for value in values)) or 1.0
+    return [value / norm for value in values]
+
+
+def find_tools(messages: List[Dict]) -> List[Dict]:
+    """Tools listed in the prompt's tool catalog, as {toolset_id, name, arguments}"""
+    tools = {}
+    for message in messages:
+        for line in (message.get("content") or "").splitlines():
+            match = TOOL_LINE.search(line.strip())
+            if match is None:
+                continue
+            try:
+                arguments = ast.literal_eval(match.group("arguments"))
+            except (ValueError, SyntaxError):
+                arguments = []
+            tools[(match.group("toolset_id"), match.group("name"))] = {
+                "toolset_id": match.group("toolset_id"),
+                "name": match.group("name"),
+                "arguments": arguments
+            }
+    return list(tools.values())
+
+
+class SchemaFaker:
+    """Random JSON instance of a JSON schema, with tool calls filled in from the tools in the prompt"""
+    def __init__(self, schema: Dict, tools: List[Dict], rng: random.Random, max_tool_calls: int = 2):
+        self.schema = schema
+        self.definitions = schema.get("$defs", schema.get("definitions", {}))
+        self.tools = tools
+        self.rng = rng
+        self.max_tool_calls = max_tool_calls
+
+    def text(self, min_words: int = 3, max_words: int = 25) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(min_words, max_words)))
+
+    def resolve(self, schema: Dict) -> Dict:
+        while "$ref" in schema:
+            schema = self.definitions.get(schema["$ref"].split("/")[-1], {})
+        return schema
+
+    def is_tool_call(self, schema: Dict) -> bool:
+        properties = self.resolve(schema).get("properties", {})
+        return {"toolset_id", "name", "arguments"} <= set(properties)
+
+    def tool_call(self) -> Dict:
+        tool = self.rng.choice(self.tools)
+        arguments = {}
+        for argument in tool["arguments"]:
+            if not isinstance(argument, dict) or "name" not in argument:
+                continue
+            argument_type = str(argument.get("type", "string")).lower()
+            if argument_type in ("int", "integer"):
+                arguments[argument["name"]] = self.rng.randint(0, 10)
+            elif argument_type in ("float", "number"):
+                arguments[argument["name"]] = round(self.rng.uniform(0, 10), 2)
+            elif argument_type in ("bool", "boolean"):
+                arguments[argument["name"]] = self.rng.random() < 0.5
+            else:
+                arguments[argument["name"]] = self.text(2, 12)
+        return {"toolset_id": tool["toolset_id"], "name": tool["name"], "arguments": arguments}
+
+    def generate(self, schema: Optional[Dict] = None):
+        schema = self.resolve(self.schema if schema is None else schema)
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+        if "const" in schema:
+            return schema["const"]
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                options = [option for option in schema[key] if self.resolve(option).get("type") != "null"]
+                return self.generate(self.rng.choice(options or schema[key]))
+        if "allOf" in schema:
+            return self.generate(schema["allOf"][0])
+
+        schema_type = schema.get("type", "object" if "properties" in schema else "string")
+        if isinstance(schema_type, list):
+            schema_type = next((option for option in schema_type if option != "null"), "null")
+        if schema_type == "object":
+            if self.is_tool_call(schema) and self.tools:
+                return self.tool_call()
+            return {name: self.generate(value) for name, value in schema.get("properties", {}).items()}
+        if schema_type == "array":
+            items = schema.get("items", {"type": "string"})
+            if self.is_tool_call(items):
+                count = self.rng.randint(0, self.max_tool_calls) if self.tools else 0
+            else:
+                count = self.rng.randint(1, 3)
+            count = max(count, schema.get("minItems", 0))
+            if "maxItems" in schema:
+                count = min(count, schema["maxItems"])
+            return [self.generate(items) for _ in range(count)]
+        if schema_type == "integer":
+            return self.rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+        if schema_type == "number":
+            return round(self.rng.uniform(schema.get("minimum", 0), schema.get("maximum", 100)), 3)
+        if schema_type == "boolean":
+            return self.rng.random() < 0.5
+        if schema_type == "null":
+            return None
+        return self.text()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOllama/0.1"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self) -> FakeOllamaConfig:
+        return self.server.config
+
+    def log_message(self, format, *args):
+        # one line per request is too much under load
+        pass
+
+    def count(self, path: str):
+        with self.server.stats_lock:
+            self.server.stats[path] = self.server.stats.get(path, 0) + 1
+
+    def read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length > 0 else b""
+        return json.loads(body) if body else {}
+
+    def send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.count(self.path)
+        if self.path == "/api/tags":
+            self.send_json({"models": [self.model_entry(model) for model in self.config.models]})
+        elif self.path == "/api/ps":
+            self.send_json({"models": [self.model_entry(model, loaded=True) for model in self.config.models]})
+        elif self.path == "/stats":
+            with self.server.stats_lock:
+                self.send_json(dict(self.server.stats))
+        elif self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        self.count(self.path)
+        try:
+            request = self.read_json()
+        except json.JSONDecodeError as e:
+            self.send_json({"error": f"invalid json: {e}"}, status=400)
+            return
+        if self.path == "/api/chat":
+            self.chat(request)
+        elif self.path == "/api/embed":
+            self.embed(request)
+        elif self.path == "/api/embeddings":
+            time.sleep(self.config.embed_latency)
+            self.send_json({"embedding": hash_embedding(request.get("prompt", ""), self.config.embedding_dim)})
+        else:
+            self.send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def model_entry(self, model: str, loaded: bool = False) -> Dict:
+        entry = {
+            "name": model,
+            "model": model,
+            "modified_at": "2025-01-01T00:00:00Z",
+            "size": 4_000_000_000,
+            "digest": hashlib.sha256(model.encode("utf-8")).hexdigest(),
+            "details": {"format": "gguf", "family": "fake", "parameter_size": "8B", "quantization_level": "Q4_0"}
+        }
+        if loaded:
+            entry["expires_at"] = "2099-01-01T00:00:00Z"
+            entry["size_vram"] = entry["size"]
+        return entry
+
+    def embed(self, request: Dict):
+        texts = request.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        time.sleep(self.config.embed_latency)
+        self.send_json({
+            "model": request.get("model", ""),
+            "embeddings": [hash_embedding(text, self.config.embedding_dim) for text in texts]
+        })
+
+    def generate_content(self, request: Dict, rng: random.Random) -> str:
+        response_format = request.get("format")
+        messages = request.get("messages", [])
+        if isinstance(response_format, dict):
+            faker = SchemaFaker(response_format, find_tools(messages), rng, self.config.max_tool_calls)
+            return json.dumps(faker.generate())
+        if response_format == "json":
+            return json.dumps({"response": " ".join(rng.choice(WORDS) for _ in range(10))})
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))
+
+    def request_seed(self, request: Dict) -> Optional[int]:
+        if self.config.seed is None:
+            return (request.get("options") or {}).get("seed")
+        tools = [(tool["toolset_id"], tool["name"]) for tool in find_tools(request.get("messages", []))]
+        key = json.dumps([self.config.seed, request.get("model"), request.get("format"), tools], sort_keys=True, default=str)
+        return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "little")
+
+    def chat(self, request: Dict):
+        rng = random.Random(self.request_seed(request))
+        start_time = time.monotonic()
+        content = self.generate_content(request, rng)
+        prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", [])) // 4 + 1
+
+        # time to first token
+        time.sleep(max(0.0, random.gauss(self.config.latency, self.config.latency_jitter)))
+        # roughly 4 characters per token
+        tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        tokens_per_second = None
+        if self.config.tokens_per_second:
+            tokens_per_second = max(1.0, random.gauss(self.config.tokens_per_second, self.config.tokens_per_second_jitter))
+
+        if request.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                if tokens_per_second:
+                    time.sleep(1.0 / tokens_per_second)
+                self.write_chunk(self.chat_chunk(request, token, done=False))
+            self.write_chunk(self.chat_chunk(request, "", done=True, prompt_tokens=prompt_tokens, eval_tokens=len(tokens), start_time=start_time))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            if tokens_per_second:
+                time.sleep(len(tokens) / tokens_per_second)
+            self.send_json(self.chat_chunk(request, content, done=True, prompt_tokens=prompt_tokens, eval_tokens=len(tokens), start_time=start_time))
+
+    def chat_chunk(self, request: Dict, content: str, done: bool, prompt_tokens: int = 0, eval_tokens: int = 0, start_time: float = 0.0) -> Dict:
+        chunk = {
+            "model": request.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done
+        }
+        if done:
+            chunk.update({
+                "done_reason": "stop",
+                "total_duration": int((time.monotonic() - start_time) * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "eval_count": eval_tokens
+            })
+        return chunk
+
+    def write_chunk(self, payload: Dict):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 11434, config: Optional[FakeOllamaConfig] = None):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.config = config if config is not None else FakeOllamaConfig()
+        self.stats: Dict[str, int] = {}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        """Serve on a daemon thread, for use from benchmarks and scripts"""
+        threading.Thread(target=self.serve_forever, daemon=True, name="fake-ollama").start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_fake_ollama_server(host: str = "127.0.0.1", port: int = 0, **config) -> FakeOllamaServer:
+    """Start a server in the background, port 0 picks a free port (see .url). config goes to FakeOllamaConfig"""
+    return FakeOllamaServer(host, port, FakeOllamaConfig(**config)).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for offline benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default="llama3.1:8b,nomic-embed-text", help="comma separated model names to report")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds to first token")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="standard deviation of the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="mean decode speed, unset returns responses at once")
+    parser.add_argument("--tokens-per-second-jitter", type=float, default=0.0, help="standard deviation of the decode speed")
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--max-tool-calls", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=None, help="overrides request seeds, for repeatable runs")
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(
+        models=[model.strip() for model in args.models.split(",") if model.strip()],
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        tokens_per_second_jitter=args.tokens_per_second_jitter,
+        embedding_dim=args.embedding_dim,
+        embed_latency=args.embed_latency,
+        max_tool_calls=args.max_tool_calls,
+        seed=args.seed
+    )
+    server = FakeOllamaServer(args.host, args.port, config)
+    print(f"Fake Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import libs.common as common
+from libs.common import CircuitBreaker, Message
+
+
+class SlowStreamClient:
+    """Stands in for ollama.AsyncClient, streams a chunk and then waits forever"""
+    async def chat(self, **kwargs):
+        async def stream():
+            yield SimpleNamespace(message=SimpleNamespace(content="hello"))
+            await asyncio.sleep(3600)
+        return stream()
+
+
+class HangingClient:
+    """Stands in for ollama.AsyncClient, never answers"""
+    async def chat(self, **kwargs):
+        await asyncio.sleep(3600)
+
+
+def half_open_breaker(monkeypatch, client):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    # the reset timeout has passed, the next request is the half open trial
+    breaker.opened_at -= breaker.reset_timeout
+    monkeypatch.setattr(common, "get_circuit_breaker", lambda url: breaker)
+    monkeypatch.setattr(common, "get_async_ollama_client", lambda url: client)
+    return breaker
+
+
+async def consume(stream):
+    async for _ in stream:
+        pass
+
+
+def test_cancelled_trial_before_first_chunk_is_released(monkeypatch):
+    breaker = half_open_breaker(monkeypatch, HangingClient())
+
+    async def run():
+        task = asyncio.create_task(consume(common.stream_ollama_chat("http://backend", "model", [Message(role="user", content="hi")])))
+        await asyncio.sleep(0.1)
+        assert breaker.state == "half_open"
+        assert not breaker.allow_request()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    assert breaker.state == "open"
+    # the trial told us nothing, the next request gets to try right away
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+
+
+def test_cancelled_trial_after_first_chunk_closes_circuit(monkeypatch):
+    breaker = half_open_breaker(monkeypatch, SlowStreamClient())
+
+    async def run():
+        task = asyncio.create_task(consume(common.stream_ollama_chat("http://backend", "model", [Message(role="user", content="hi")])))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    assert breaker.state == "closed"
+
+
+def test_closed_stream_resolves_trial(monkeypatch):
+    breaker = half_open_breaker(monkeypatch, SlowStreamClient())
+
+    async def run():
+        stream = common.stream_ollama_chat("http://backend", "model", [Message(role="user", content="hi")])
+        assert await stream.__anext__() == "hello"
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert breaker.state == "closed"
+
+
+def test_unresolved_trial_expires():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    # the trial never reported back
+    breaker.opened_at -= breaker.reset_timeout
+    assert breaker.is_available()
+    assert breaker.allow_request()
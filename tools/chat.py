@@ -1,7 +1,7 @@
 from sqlmodel import SQLModel, Field, select
 from libs.vector_storage import VectorStorage
 from libs.agent_interface import AgentInterface
-from libs.common import get_tool_schemas_from_class
+from libs.common import get_tool_schemas_from_class, agent_tool
 from libs.agent import AgentStateDBO
 from typing import Optional, Dict
 import uuid
@@ -24,6 +24,7 @@ class Chat(AgentInterface):
         self.ollama_server = "http://localhost:11434"
         self.embedding_model = "nomic-embed-text"
         self.chat_id = "1"
+        self.write_behind = False
 
         if init_keys is not None:
             if "chroma_db_path" in init_keys:
@@ -36,6 +37,8 @@ class Chat(AgentInterface):
                 self.embedding_model = init_keys["embedding_model"]
             if "chat_id" in init_keys:
                 self.chat_id = init_keys["chat_id"]
+            if "write_behind" in init_keys:
+                self.write_behind = init_keys["write_behind"]
 
         self.toolset_name = "chat"
         self.all_tools = get_tool_schemas_from_class(self)
@@ -48,9 +51,11 @@ class Chat(AgentInterface):
             default_embedding_model=self.embedding_model,
             embed_field="content",
             id_field="id",
-            collection_name=f"chat_{self.chat_id}"
+            collection_name=f"chat_{self.chat_id}",
+            write_behind=self.write_behind
         )
         
+    @agent_tool
     def send_message(self, agent_state: AgentStateDBO, user_name: str, message: str):
         """{
             "toolset_id": "chat",
@@ -68,6 +73,7 @@ class Chat(AgentInterface):
         self.chat_vector_storage.add(chat_message, metadata_fields=["id", "created_at"])
         return f"Message sent: {user_name}: {message}"
     
+    @agent_tool
     def read_chat(self, agent_state: AgentStateDBO, limit: int = 10, offset: int = 0):
         """
         {
@@ -88,16 +94,8 @@ class Chat(AgentInterface):
             # step backwards through the messages
             for i in range(len(messages) - 1, -1, -1):
                 message = messages[i]
-                # get time ago string
-                time_ago = datetime.now() - message.created_at
-                # x seconds ago, x minutes ago, x hours ago, x days ago 
-                if time_ago.seconds < 60:
-                    time_ago_str = f"{time_ago.seconds} seconds ago"
-                elif time_ago.seconds < 3600:
-                    time_ago_str = f"{time_ago.seconds // 60} minutes ago"
-                else:
-                    time_ago_str = f"{time_ago.seconds // 3600} hours ago"
-                messages_str += f"{message.user_id}({time_ago_str}): {message.content} \n"
+                # absolute time, so the same messages read the same on every pass
+                messages_str += f"{message.user_id}({message.created_at.strftime('%Y-%m-%d %H:%M:%S')}): {message.content} \n"
             return messages_str
 
 
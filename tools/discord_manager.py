@@ -10,7 +10,7 @@ import discord
 from discord.commands import SlashCommandGroup, Option
 
 from libs.agent_interface import AgentInterface
-from libs.common import ToolCall, ToolCallResult, ToolSchema, ToolsetDetails, get_tool_schemas_from_class
+from libs.common import ToolCall, ToolCallResult, ToolSchema, ToolsetDetails, get_tool_schemas_from_class, agent_tool
 from libs.agent import AgentStateDBO
 
 logger = logging.getLogger(__name__)
@@ -36,6 +36,7 @@ class DiscordManagerInterface(AgentInterface):
         self.toolset_name = "discord_manager"
         self.all_tools = get_tool_schemas_from_class(self)
 
+    @agent_tool
     def send_message(self, agent_state: AgentStateDBO, channel_id: str, content: str, reply_to_message_id: Optional[str] = None) -> ToolCallResult:
         """{
             "toolset_id": "discord_manager",
@@ -88,6 +89,7 @@ class DiscordManagerInterface(AgentInterface):
                 ),
                 error=f"Error sending message: {str(e)}"
             )
+    @agent_tool
     def get_channels(self, agent_state: AgentStateDBO) -> ToolCallResult:
         """{
             "toolset_id": "discord_manager",
@@ -144,6 +146,7 @@ class DiscordManagerInterface(AgentInterface):
                 error=f"Error getting channels: {str(e)}"
             )
 
+    @agent_tool
     def read_discord_messages(self, agent_state: AgentStateDBO, channel_id: str, limit: int = 15, offset: int = 0) -> ToolCallResult:
         """{
             "toolset_id": "discord_manager",
@@ -292,6 +295,7 @@ class DiscordManagerInterface(AgentInterface):
         
         return messages
 
+    @agent_tool
     def start_discord_bot(self, agent_state: AgentStateDBO) -> ToolCallResult:
         """{
             "toolset_id": "discord_manager",
@@ -382,6 +386,7 @@ class DiscordManagerInterface(AgentInterface):
                 error=f"Error starting Discord bot: {str(e)}"
             )
 
+    @agent_tool
     def stop_discord_bot(self, agent_state: AgentStateDBO) -> ToolCallResult:
         """{
             "toolset_id": "discord_manager",
@@ -465,6 +470,7 @@ class DiscordManagerInterface(AgentInterface):
             )
 
     # Example method to add a slash command (Pycord-specific)
+    @agent_tool
     def add_slash_command(self, agent_state: AgentStateDBO, command_name: str, description: str, options: List[Dict[str, Any]] = None) -> ToolCallResult:
         """{
             "toolset_id": "discord_manager",
@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import List, Optional, Dict
 
 from libs.agent_interface import AgentInterface
-from libs.common import ToolsetDetails, ToolSchema, ToolCall, ToolCallResult, get_tool_schemas_from_class, Message, call_ollama_chat, embed_with_ollama
+from libs.common import ToolsetDetails, ToolSchema, ToolCall, ToolCallResult, get_tool_schemas_from_class, agent_tool, Message, call_ollama_chat, embed_with_ollama
 from libs.agent import AgentStateDBO, Agent
 from libs.vector_storage import VectorStorage
 import uuid
@@ -43,6 +43,7 @@ class MemoryManager(AgentInterface):
         self.sqlite_db_path = "memory_manager_sqlite_db.db"
         self.ollama_server = "http://localhost:11434"
         self.embedding_model = "nomic-embed-text"
+        self.write_behind = False
 
         if init_keys is not None:
             if "chroma_db_path" in init_keys:
@@ -53,6 +54,8 @@ class MemoryManager(AgentInterface):
                 self.ollama_server = init_keys["ollama_server"]
             if "embedding_model" in init_keys:
                 self.embedding_model = init_keys["embedding_model"]
+            if "write_behind" in init_keys:
+                self.write_behind = init_keys["write_behind"]
 
 
 
@@ -72,10 +75,12 @@ class MemoryManager(AgentInterface):
             default_embedding_model=self.embedding_model,
             embed_field="content",
             id_field="id",
-            collection_name=f"memory_{self.memory_manager_dbo.memory_set_id}"
+            collection_name=f"memory_{self.memory_manager_dbo.memory_set_id}",
+            write_behind=self.write_behind
         )
         
 
+    @agent_tool
     def extract_memories(self, agent_state: AgentStateDBO):
         """
         {
@@ -114,14 +119,17 @@ class MemoryManager(AgentInterface):
             raise e
         
         
+        # store all extracted memories with one embedding request and one bulk insert
+        new_memories = []
         for memory in extracted_memories.memories:
-            mem = MemoryDBO(id=str(uuid.uuid4()), 
+            new_memories.append(MemoryDBO(id=str(uuid.uuid4()), 
                             content=memory,
-                              created_at=datetime.now())
-            self.memory_vector_storage.add(mem, metadata_fields=["id", "created_at"])
+                              created_at=datetime.now()))
+        self.memory_vector_storage.add_many(new_memories, metadata_fields=["id", "created_at"])
 
         return ""
 
+    @agent_tool
     def get_relevant_memories(self, agent_state: AgentStateDBO):
         """
         {
@@ -151,11 +159,8 @@ class MemoryManager(AgentInterface):
         query_message_buffer.append(Message(role="user", content=query_prompt))
         query_response = call_ollama_chat(agent_state.llm_server_url, agent_state.llm_model, query_message_buffer, json_schema=QueryExtractionSchema.model_json_schema())
         queries = QueryExtractionSchema.model_validate_json(query_response)
-        raw_memory_results = []
-        for query in queries.queries:
-            results = self.memory_vector_storage.query_similar(query, n_results=10)
-            # add the results to the message buffer
-            raw_memory_results.append(results)
+        # all queries are embedded and searched in one go, hits are merged and deduplicated
+        memory_results = self.memory_vector_storage.query_similar_many(queries.queries, n_results=10, hydrate=False, fuse=True)["fused"]
         
         approval_prompt = f"""
         Given the context available to you, return a list of memory IDs that are relevant to the query.
@@ -166,22 +171,22 @@ class MemoryManager(AgentInterface):
         approval_message_buffer = raw_message_buffer.copy()
 
         memory_results_str = ""
-        for i, results in enumerate(raw_memory_results):
-            memory_results_str += f"Query {i+1}:\n"
-            for result in results:
-                memory_results_str += f"{result['id']}: {result['content']}\n"
+        for result in memory_results:
+            memory_results_str += f"{result['id']}: {result['content']}\n"
 
         approval_message_buffer.append(Message(role="user", content=f"Memory results:\n{memory_results_str}"))
         approval_message_buffer.append(Message(role="user", content=approval_prompt))
         approval_response = call_ollama_chat(agent_state.llm_server_url, agent_state.llm_model, approval_message_buffer, json_schema=MemoryApprovalSchema.model_json_schema())
         relevant_memory_ids = MemoryApprovalSchema.model_validate_json(approval_response)
-        relevant_memories = [raw_memory_results[i][relevant_memory_ids.relevant_memory_ids[i]] for i in range(len(relevant_memory_ids.relevant_memory_ids))]
+        memory_results_by_id = {result['id']: result for result in memory_results}
+        relevant_memories = [memory_results_by_id[memory_id] for memory_id in relevant_memory_ids.relevant_memory_ids if memory_id in memory_results_by_id]
         relevant_memories_str = ""
         for memory in relevant_memories:
             relevant_memories_str += f"{memory['id']}: {memory['content']}\n"
         print(f"Relevant memories: {relevant_memories_str}")
         return relevant_memories_str
 
+    @agent_tool
     def query_memories(self, agent_state: AgentStateDBO, query: str, limit: int = 10):
         """
         {
@@ -200,6 +205,7 @@ class MemoryManager(AgentInterface):
         results = self.memory_vector_storage.query_similar(query, n_results=limit)
         pass
 
+    @agent_tool
     def get_recent_contextual_summaries(self, agent_state: AgentStateDBO):
         """
         {
@@ -6,7 +6,7 @@ from pydantic import BaseModel
 from libs.agent_interface import AgentInterface
 from libs.agent import AgentStateDBO
 from libs.vector_storage import VectorStorage
-from libs.common import get_tool_schemas_from_class, ToolsetDetails, ToolSchema, ToolCall, ToolCallResult, Message, call_ollama_chat
+from libs.common import get_tool_schemas_from_class, agent_tool, ToolsetDetails, ToolSchema, ToolCall, ToolCallResult, Message, call_ollama_chat
 from libs.demographic_seeds import DemographicSeedManager
 import random
 import string
@@ -63,6 +63,7 @@ class Persona(AgentInterface):
 
         self.all_tools = get_tool_schemas_from_class(self)
 
+    @agent_tool
     def create_persona(self, agent_state: AgentStateDBO, name: Optional[str] = None, description: Optional[str] = None) -> str:
         """
         {
@@ -101,7 +102,7 @@ class Persona(AgentInterface):
             name_message_buffer = [
                 Message(role="user", content=name_selector_prompt)
             ]
-            name_selection = call_ollama_chat(agent_state.llm_server_url, agent_state.llm_model, name_message_buffer, json_schema=PersonaNameSelectorSchema.model_json_schema())
+            name_selection = call_ollama_chat(agent_state.llm_server_url, agent_state.llm_model, name_message_buffer, json_schema=PersonaNameSelectorSchema.model_json_schema(), cache=True)
             name_selection = PersonaNameSelectorSchema.model_validate_json(name_selection)
             name = name_selection.name
 
@@ -120,7 +121,7 @@ class Persona(AgentInterface):
         description_message_buffer = [
             Message(role="user", content=persona_description_prompt)
         ]
-        description_selection = call_ollama_chat(agent_state.llm_server_url, agent_state.llm_model, description_message_buffer, json_schema=PersonaDescriptionSchema.model_json_schema())
+        description_selection = call_ollama_chat(agent_state.llm_server_url, agent_state.llm_model, description_message_buffer, json_schema=PersonaDescriptionSchema.model_json_schema(), cache=True)
         description_selection = PersonaDescriptionSchema.model_validate_json(description_selection)
         description = description_selection.description
         
@@ -152,6 +153,7 @@ class Persona(AgentInterface):
         self.current_persona = persona_dbo
         return f"Persona set: {persona_dbo.name}\nDescription: {persona_dbo.description}"
 
+    @agent_tool
     def get_persona_string(self, agent_state: AgentStateDBO):
         """{
             "toolset_id": "persona",
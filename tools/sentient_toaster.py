@@ -1,11 +1,13 @@
 from pydantic import BaseModel
-from sqlmodel import SQLModel, Field, Session, create_engine, select
+from sqlmodel import SQLModel, Field, Session, select
 from typing import List, Dict, Any, Literal
 import uuid
 from datetime import datetime
 from enum import Enum
 from sqlmodel import Column, JSON
 from libs.common import call_ollama_chat, Message, get_tool_schemas_from_class
+from libs.vector_storage import get_sqlite_engine
+from libs.llm_cache import configure_llm_cache
 import hashlib
 import json
 import os
@@ -64,7 +66,7 @@ def generate_sentient_toaster_template(llm_server_url: str, llm_model: str, desc
         Message(role="user", content=st_generator_user_prompt)
     ]
 
-    response = call_ollama_chat(llm_server_url, llm_model, messages, json_schema=SentientToasterTemplateLLMSchema.model_json_schema())
+    response = call_ollama_chat(llm_server_url, llm_model, messages, json_schema=SentientToasterTemplateLLMSchema.model_json_schema(), cache=True)
     response = SentientToasterTemplateLLMSchema.model_validate_json(response)
 
     
@@ -168,7 +170,7 @@ class SentientToasterManager:
         self.db_path = db_path
         self.llm_server_url = llm_server_url
         self.llm_model = llm_model
-        self.engine = create_engine(f"sqlite:///{db_path}")
+        self.engine = get_sqlite_engine(db_path)
         SQLModel.metadata.create_all(self.engine)
         self.db = Session(self.engine)
 
@@ -203,7 +205,7 @@ class SentientToasterManager:
         messages = [
             Message(role="user", content=get_initial_state_prompt)
         ]
-        response = call_ollama_chat(self.llm_server_url, self.llm_model, messages, json_schema=InitialStateSchema.model_json_schema())
+        response = call_ollama_chat(self.llm_server_url, self.llm_model, messages, json_schema=InitialStateSchema.model_json_schema(), cache=True)
         response = InitialStateSchema.model_validate_json(response)
 
         result_dbo = SentientToasterDBO(
@@ -532,6 +534,8 @@ if __name__ == "__main__":
         "a kaleidoscope that shows possible futures"
     ]
     
+    # the batch is rerun often, pin seeds so templates and initial states come from the LLM cache on reruns
+    configure_llm_cache(pin_seeds=True)
     manager = SentientToasterManager("http://localhost:5000", "llama3.1:8b", db_path)
     
 
@@ -0,0 +1,56 @@
+from typing import List
+from libs.agent_interface import AgentInterface
+from libs.common import ToolsetDetails, ToolSchema, ToolCall, ToolCallResult, get_tool_schemas_from_class, agent_tool
+from libs.tool_call_archive import ToolCallArchive
+
+class ToolHistory(AgentInterface):
+    """Lets an agent page back through tool call results that were archived out of its state"""
+    def __init__(self, tool_call_archive: ToolCallArchive):
+        self.tool_call_archive = tool_call_archive
+        self.toolset_name = "tool_history"
+        self.all_tools = get_tool_schemas_from_class(self)
+
+    @agent_tool
+    def read_archived_tool_results(self, agent_state, offset: int = 0, limit: int = 5):
+        """
+        {
+            "toolset_id": "tool_history",
+            "name": "read_archived_tool_results",
+            "description": "Read older tool call results that are no longer in your context, newest first",
+            "is_long_running": false,
+            "expose_to_agent": true,
+            "arguments": [
+                {"name": "offset", "type": "int", "description": "The number of archived results to skip, newest first (default: 0)"},
+                {"name": "limit", "type": "int", "description": "The number of archived results to return (default: 5)"}
+            ]
+        }
+        """
+        total = self.tool_call_archive.count(agent_state.id)
+        results = self.tool_call_archive.get_page(agent_state.id, offset=offset, limit=limit)
+        if len(results) == 0:
+            return f"No archived tool results at offset {offset} ({total} archived)"
+
+        result_str = f"Archived tool results {offset + 1}-{offset + len(results)} of {total} (newest first):\n"
+        for tool_result in results:
+            result_str += f"Called: {tool_result.tool_call.toolset_id} {tool_result.tool_call.name}({tool_result.tool_call.arguments})\n"
+            result_str += f"Tool result: {tool_result.result}\n"
+        return result_str
+
+    ########### AGENT INTERFACE ###########
+    def get_toolset_details(self) -> ToolsetDetails:
+        return ToolsetDetails(
+            toolset_id=self.toolset_name,
+            name=self.toolset_name,
+            description="Older tool call results that were moved out of your context"
+        )
+
+    def get_tool_schemas(self) -> List[ToolSchema]:
+        return self.all_tools
+
+    def agent_tool_callback(self, agent_state, tool_call: ToolCall) -> ToolCallResult:
+        result = getattr(self, tool_call.name)(agent_state, **tool_call.arguments)
+        return ToolCallResult(
+            toolset_id=self.toolset_name,
+            tool_call=tool_call,
+            result=result
+        )